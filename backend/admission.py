@@ -0,0 +1,136 @@
+#AI调用准入控制：每个后端并发上限 + 有界等待队列，每个用户令牌桶限流
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from metrics import admission_in_flight, admission_queue_depth, admission_rejections
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))  # per backend, override with AI_MAX_CONCURRENCY_OLLAMA etc.
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))  # callers allowed to wait for a slot, per backend
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "10"))  # seconds a caller may wait before 503
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))  # AI requests refilled per user per minute
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))  # bucket size
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+
+
+class AdmissionRejected(HTTPException):
+    """429/503 with Retry-After, raised before any work is done"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class BackendLimiter:
+    """at most `limit` calls in flight; up to `max_queue` callers wait, each for at most `timeout` seconds"""
+
+    def __init__(self, backend: str, limit: int, max_queue: int, timeout: float):
+        self.backend = backend
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.active = 0
+        self._queue_gauge = admission_queue_depth.labels(backend)
+        self._active_gauge = admission_in_flight.labels(backend)
+
+    def _reject(self, reason: str, detail: str):
+        admission_rejections.labels(self.backend, reason).inc()
+        raise AdmissionRejected(503, detail, self.timeout)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full", f"{self.backend} backend is at capacity, try again later")
+            self.waiting += 1
+            self._queue_gauge.set(self.waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self._reject("timeout", f"timed out waiting for the {self.backend} backend, try again later")
+            finally:
+                self.waiting -= 1
+                self._queue_gauge.set(self.waiting)
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        self._active_gauge.set(self.active)
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._active_gauge.set(self.active)
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "max_queue": self.max_queue}
+
+
+_limiters: dict[str, BackendLimiter] = {}
+
+
+def backend_limiter(backend: str) -> BackendLimiter:
+    limiter = _limiters.get(backend)
+    if limiter is None:
+        limit = int(os.getenv(f"AI_MAX_CONCURRENCY_{backend.upper()}", AI_MAX_CONCURRENCY))
+        limiter = BackendLimiter(backend, limit, AI_MAX_QUEUE, AI_QUEUE_TIMEOUT)
+        _limiters[backend] = limiter
+    return limiter
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+
+class UserRateLimiter:
+    """token bucket per user id: RATE_LIMIT_BURST requests at once, refilled at RATE_LIMIT_PER_MINUTE"""
+
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST,
+                 max_users: int = RATE_LIMIT_MAX_USERS):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def check(self, user_id: int, cost: float = 1.0):
+        """take cost tokens from the user's bucket or raise 429; 413 when cost exceeds the bucket size"""
+        if cost > self.burst:
+            # waiting never helps, the bucket cannot hold this many tokens
+            admission_rejections.labels("user", "over_burst").inc()
+            raise HTTPException(status_code=413, detail=f"request needs {cost:g} AI calls, at most {self.burst:g} "
+                                                        "are allowed per request (RATE_LIMIT_BURST)")
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.burst)
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        now = time.monotonic()
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        if bucket.tokens < cost:
+            admission_rejections.labels("user", "rate_limited").inc()
+            raise AdmissionRejected(429, "too many AI requests, slow down", (cost - bucket.tokens) / self.rate)
+        bucket.tokens -= cost
+
+
+user_rate_limiter = UserRateLimiter()
+
+
+def admission_stats() -> dict:
+    return {backend: limiter.stats() for backend, limiter in _limiters.items()}
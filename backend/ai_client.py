@@ -0,0 +1,432 @@
+#异步AI客户端，所有后端共用一个连接池
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from admission import backend_limiter
+from cassette import AI_RECORD_BACKEND, cassette_key, cassette_store
+from fake_backend import AI_FAKE_LATENCY, fake_generate, fake_reply, fake_stream, split_tokens
+from hedging import AI_HEDGE_ENABLED, hedge_policy
+from json_stream import JsonObjectExtractor
+from ollama_pool import OllamaPool
+from metrics import llm_errors, llm_request_duration, llm_tokens_saved
+from singleflight import SingleFlight
+
+# AI backend config
+# optional: "openai", "ollama", "huggingface", "fake" (benchmarks),
+# "record" (call AI_RECORD_BACKEND and save replies), "replay" (serve saved replies offline)
+AI_BACKEND = os.getenv("AI_BACKEND", "ollama")
+
+# OpenAI config
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
+
+# Ollama config
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# comma-separated instances, e.g. "http://gpu1:11434,http://gpu2:11434"; defaults to OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [url.strip().rstrip("/") for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",") if url.strip()]
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "300"))  # free-text replies (advice)
+OLLAMA_JSON_NUM_PREDICT = int(os.getenv("OLLAMA_JSON_NUM_PREDICT", "1024"))  # room for the full nutrition object
+
+# HuggingFace config
+HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
+HUGGINGFACE_MODEL = os.getenv("HUGGINGFACE_MODEL", "microsoft/DialoGPT-medium")
+HUGGINGFACE_BASE_URL = os.getenv("HUGGINGFACE_BASE_URL", "https://api-inference.huggingface.co/models")
+
+# connection pool config (seconds / connection counts)
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "5"))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "120"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "100"))
+AI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", "30"))
+# whole-call deadline on top of connect/read timeouts, 0 disables
+AI_TOTAL_TIMEOUT = float(os.getenv("AI_TOTAL_TIMEOUT", "180"))
+
+# coalesce identical concurrent prompts into one generation
+AI_SINGLE_FLIGHT = os.getenv("AI_SINGLE_FLIGHT", "true").lower() == "true"
+
+# stream JSON replies and hang up once the top-level object closes
+AI_STREAM_JSON = os.getenv("AI_STREAM_JSON", "true").lower() == "true"
+
+_http_client: Optional[httpx.AsyncClient] = None
+ai_single_flight = SingleFlight()
+
+
+def model_name_for(backend: str) -> str:
+    """the concrete model a backend is configured to use"""
+    return {
+        "openai": OPENAI_MODEL,
+        "ollama": OLLAMA_MODEL,
+        "huggingface": HUGGINGFACE_MODEL,
+    }.get(backend, backend)
+
+
+def _setting_for(backend: str, name: str, default: float) -> float:
+    # per-backend override, e.g. AI_READ_TIMEOUT_OLLAMA=300 for CPU boxes
+    return float(os.getenv(f"{name}_{backend.upper()}", default))
+
+
+BACKEND_TIMEOUTS = {
+    backend: httpx.Timeout(
+        _setting_for(backend, "AI_READ_TIMEOUT", AI_READ_TIMEOUT),
+        connect=_setting_for(backend, "AI_CONNECT_TIMEOUT", AI_CONNECT_TIMEOUT),
+    )
+    for backend in ("openai", "ollama", "huggingface")
+}
+BACKEND_DEADLINES = {
+    backend: _setting_for(backend, "AI_TOTAL_TIMEOUT", AI_TOTAL_TIMEOUT)
+    for backend in ("openai", "ollama", "huggingface")
+}
+
+
+async def _with_deadline(model: str, call: Awaitable):
+    """bound a whole backend call, 504 when it runs past the backend's deadline"""
+    deadline = BACKEND_DEADLINES.get(model, AI_TOTAL_TIMEOUT)
+    if deadline <= 0:
+        return await call
+    try:
+        return await asyncio.wait_for(call, deadline)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"{model} backend did not answer within {deadline:g}s")
+
+
+def _hedged(model: str, call: Callable[[str], Awaitable]):
+    # call(backend) runs once, or twice racing primary and secondary when hedging is on
+    return hedge_policy.run(model, call) if AI_HEDGE_ENABLED else call(model)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """return the shared keep-alive client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=AI_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+
+ollama_pool = OllamaPool(OLLAMA_BASE_URLS, get_http_client)
+
+
+async def close_http_client():
+    """close the shared client, called on app shutdown"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def get_ai_response(prompt: str, model: str = "ollama", json_schema: Optional[dict] = None):
+    """
+        unified AI call interface, support openai, ollama, huggingface
+        identical concurrent prompts share a single in-flight generation
+        json_schema asks the backend for a reply constrained to that schema
+        (ollama: format=<schema>, openai: JSON mode, huggingface: unconstrained)
+    """
+    def call():
+        return _hedged(model, lambda backend: _call_backend(prompt, backend, json_schema))
+
+    if not AI_SINGLE_FLIGHT:
+        return await call()
+    # whitespace-only differences between prompts do not change the generation
+    key = (model, model_name_for(model), " ".join(prompt.split()), json_schema is not None)
+    return await ai_single_flight.do(key, call)
+
+
+async def get_ai_json_response(prompt: str, model: str = "ollama", json_schema: Optional[dict] = None) -> tuple[str, int]:
+    """
+        reply containing one JSON object, returned as (object text, tokens saved)
+        ollama/openai replies are streamed and cancelled as soon as the object is complete;
+        tokens saved is the generation budget left unused by that cancellation
+    """
+    def call():
+        return _hedged(model, lambda backend: _with_deadline(backend, _collect_json_object(prompt, backend, json_schema)))
+
+    if not AI_SINGLE_FLIGHT:
+        return await call()
+    key = (model, model_name_for(model), " ".join(prompt.split()), json_schema is not None, "json-object")
+    return await ai_single_flight.do(key, call)
+
+
+async def _collect_json_object(prompt: str, model: str, json_schema: Optional[dict]) -> tuple[str, int]:
+    if not AI_STREAM_JSON or model not in ("ollama", "openai", "fake"):
+        content = await _call_backend(prompt, model, json_schema)
+        extractor = JsonObjectExtractor()
+        return extractor.feed(content) or content, 0
+    extractor = JsonObjectExtractor()
+    chunks = []
+    tokens_used = 0
+    stream = stream_ai_response(prompt, model, json_schema)
+    cut_off = False
+    try:
+        async for token in stream:
+            # ollama and openai stream roughly one token per chunk
+            tokens_used += 1
+            chunks.append(token)
+            if extractor.feed(token) is not None:
+                break
+        if extractor.result is not None:
+            # peek at one more chunk: only a model still generating after the object was actually cut off,
+            # one that ends at the closing brace (e.g. with a format schema) saved nothing
+            try:
+                await stream.__anext__()
+                cut_off = True
+            except StopAsyncIteration:
+                pass
+    finally:
+        # closing the generator closes the HTTP stream, which stops the generation upstream
+        await stream.aclose()
+    if extractor.result is None:
+        # stream ended without a complete object, let the caller validate or repair what came back
+        return extractor.partial() or "".join(chunks), 0
+    if not cut_off:
+        return extractor.result, 0
+    if model == "openai":
+        budget = OPENAI_MAX_TOKENS
+    elif json_schema is not None:
+        budget = OLLAMA_JSON_NUM_PREDICT
+    else:
+        budget = OLLAMA_NUM_PREDICT
+    # upper bound: the rest of the budget, the model might have stopped sooner on its own
+    tokens_saved = max(budget - tokens_used - 1, 0)
+    llm_tokens_saved.labels(model, model_name_for(model)).inc(tokens_saved)
+    return extractor.result, tokens_saved
+
+
+async def _call_backend(prompt: str, model: str, json_schema: Optional[dict] = None):
+    # wait for a backend slot (or get a fast 503) before the call is timed
+    async with backend_limiter(model).slot():
+        labels = (model, model_name_for(model))
+        start = time.perf_counter()
+        try:
+            return await _with_deadline(model, _request_backend(prompt, model, json_schema))
+        except Exception:
+            llm_errors.labels(*labels).inc()
+            raise
+        finally:
+            llm_request_duration.labels(*labels).observe(time.perf_counter() - start)
+
+
+async def _request_backend(prompt: str, model: str, json_schema: Optional[dict] = None):
+    client = get_http_client()
+    if model == "openai":
+        if not OPENAI_API_KEY:
+            raise HTTPException(status_code=500, detail="OpenAI API Key not set")
+        payload = {
+            "model": OPENAI_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.2,
+            "max_tokens": OPENAI_MAX_TOKENS
+        }
+        if json_schema is not None:
+            payload["response_format"] = {"type": "json_object"}
+        try:
+            response = await client.post(
+                f"{OPENAI_BASE_URL}/chat/completions",
+                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+                json=payload,
+                timeout=BACKEND_TIMEOUTS["openai"]
+            )
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    elif model == "ollama":
+        payload = {
+            "model": OLLAMA_MODEL,
+            "prompt": prompt,
+            "stream": False,
+            "options": {
+                "temperature": 0.2,
+                "num_predict": OLLAMA_NUM_PREDICT
+            }
+        }
+        if json_schema is not None:
+            payload["format"] = json_schema
+            payload["options"]["num_predict"] = OLLAMA_JSON_NUM_PREDICT
+        try:
+            # least-loaded healthy instance, retried once on another instance if it fails
+            return (await ollama_pool.post_json("/api/generate", payload, BACKEND_TIMEOUTS["ollama"]))["response"]
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
+    elif model == "huggingface":
+        if not HUGGINGFACE_API_KEY:
+            raise HTTPException(status_code=500, detail="HuggingFace API Key not set")
+        try:
+            response = await client.post(
+                f"{HUGGINGFACE_BASE_URL}/{HUGGINGFACE_MODEL}",
+                headers={"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"},
+                json={"inputs": prompt},
+                timeout=BACKEND_TIMEOUTS["huggingface"]
+            )
+            response.raise_for_status()
+            return response.json()[0]["generated_text"]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"HuggingFace API error: {str(e)}")
+    elif model == "fake":
+        return await fake_generate(prompt, json_schema)
+    elif model == "record":
+        start = time.perf_counter()
+        response = await _request_backend(prompt, AI_RECORD_BACKEND, json_schema)
+        elapsed = time.perf_counter() - start
+        cassette_store.put(cassette_key(prompt, json_schema), AI_RECORD_BACKEND, model_name_for(AI_RECORD_BACKEND),
+                           response, elapsed, elapsed)
+        return response
+    elif model == "replay":
+        entry = cassette_store.get(cassette_key(prompt, json_schema))
+        if entry is None:
+            # unrecorded prompt: deterministic stand-in reply
+            await asyncio.sleep(cassette_store.replay_delay(None, AI_FAKE_LATENCY))
+            return fake_reply(prompt, json_schema)
+        await asyncio.sleep(cassette_store.replay_delay(entry["latency"], AI_FAKE_LATENCY))
+        return entry["response"]
+    else:
+        raise HTTPException(status_code=500, detail=f"Unsupported AI backend: {model}")
+
+
+async def stream_ai_response(prompt: str, model: str = "ollama", json_schema: Optional[dict] = None) -> AsyncIterator[str]:
+    """
+        streaming variant of get_ai_response, yields text chunks as the model produces them
+        huggingface has no streaming API here, so its full reply is yielded once
+    """
+    # the backend slot is held for the whole stream
+    async with backend_limiter(model).slot():
+        labels = (model, model_name_for(model))
+        start = time.perf_counter()
+        tokens = _stream_backend(prompt, model, json_schema)
+        try:
+            async for token in tokens:
+                yield token
+        except Exception:
+            llm_errors.labels(*labels).inc()
+            raise
+        finally:
+            await tokens.aclose()
+            # time until the stream finished or the consumer stopped reading
+            llm_request_duration.labels(*labels).observe(time.perf_counter() - start)
+
+
+async def _stream_backend(prompt: str, model: str, json_schema: Optional[dict] = None) -> AsyncIterator[str]:
+    client = get_http_client()
+    if model == "openai":
+        if not OPENAI_API_KEY:
+            raise HTTPException(status_code=500, detail="OpenAI API Key not set")
+        payload = {
+            "model": OPENAI_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.2,
+            "max_tokens": OPENAI_MAX_TOKENS,
+            "stream": True
+        }
+        if json_schema is not None:
+            payload["response_format"] = {"type": "json_object"}
+        try:
+            async with client.stream(
+                "POST",
+                f"{OPENAI_BASE_URL}/chat/completions",
+                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+                json=payload,
+                timeout=BACKEND_TIMEOUTS["openai"]
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    # server-sent events: "data: {...}" lines, terminated by "data: [DONE]"
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    token = choices[0].get("delta", {}).get("content")
+                    if token:
+                        yield token
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    elif model == "ollama":
+        payload = {
+            "model": OLLAMA_MODEL,
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                "temperature": 0.2,
+                "num_predict": OLLAMA_NUM_PREDICT
+            }
+        }
+        if json_schema is not None:
+            payload["format"] = json_schema
+            payload["options"]["num_predict"] = OLLAMA_JSON_NUM_PREDICT
+        lines = ollama_pool.stream_lines("/api/generate", payload, BACKEND_TIMEOUTS["ollama"])
+        try:
+            # newline-delimited JSON, one object per generated chunk
+            async for line in lines:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
+        finally:
+            # release the instance (and its outstanding count) now rather than at garbage collection
+            await lines.aclose()
+    elif model == "fake":
+        async for token in fake_stream(prompt, json_schema):
+            yield token
+    elif model == "record":
+        chunks = []
+        first_token = None
+        start = time.perf_counter()
+        tokens = _stream_backend(prompt, AI_RECORD_BACKEND, json_schema)
+        try:
+            async for token in tokens:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                chunks.append(token)
+                yield token
+        finally:
+            await tokens.aclose()
+            # saved even when the consumer stopped early, that is the reply it actually used
+            if chunks:
+                cassette_store.put(cassette_key(prompt, json_schema), AI_RECORD_BACKEND,
+                                   model_name_for(AI_RECORD_BACKEND), "".join(chunks),
+                                   time.perf_counter() - start, first_token)
+    elif model == "replay":
+        entry = cassette_store.get(cassette_key(prompt, json_schema))
+        if entry is None:
+            text = fake_reply(prompt, json_schema)
+            first_token = cassette_store.replay_delay(None, AI_FAKE_LATENCY)
+            rest = 0.0
+        else:
+            text = entry["response"]
+            first_token = cassette_store.replay_delay(entry["first_token"], AI_FAKE_LATENCY)
+            # spread the recorded generation time over the tokens
+            rest = cassette_store.replay_delay(max(entry["latency"] - entry["first_token"], 0.0), 0.0)
+        pieces = split_tokens(text)
+        await asyncio.sleep(first_token)
+        for token in pieces:
+            if rest > 0:
+                await asyncio.sleep(rest / len(pieces))
+            yield token
+    else:
+        yield await _request_backend(prompt, model, json_schema)
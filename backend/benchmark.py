@@ -0,0 +1,225 @@
+#进程内压测：通过ASGI transport直接驱动FastAPI app，AI后端用确定性的假后端
+"""
+in-process load benchmark for the NutriCoach API
+
+    python benchmark.py --concurrency 16 --requests 200 --output baseline.json
+    python benchmark.py --compare baseline.json   # exit code 1 on regressions
+
+runs against a fresh SQLite database and the fake AI backend unless overridden
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+SCENARIOS = [
+    "analyze_food",
+    "analyze_food_cached",
+    "meals",
+    "daily_summary",
+    "daily_summary_range",
+    "profile_get",
+    "profile_update",
+    "generate_advice",
+    "generate_meal_advice",
+]
+CACHED_FOODS = ["exotic stew", "mystery curry", "house salad special", "chef's noodles", "street skewers"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="in-process NutriCoach API benchmark")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--users", type=int, default=10, help="users the requests are spread over")
+    parser.add_argument("--meals-per-user", type=int, default=200, help="seeded meal history per user")
+    parser.add_argument("--days", type=int, default=90, help="days the seeded meals are spread over")
+    parser.add_argument("--ai-latency", type=float, default=0.05, help="fake AI backend latency in seconds")
+    parser.add_argument("--ai-token-delay", type=float, default=0.002, help="fake AI delay between streamed tokens")
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON (baseline) to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95/throughput regression ratio")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # main.py and its modules read their settings at import time, so this must run first
+    workdir = tempfile.mkdtemp(prefix="nutricoach-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ["AI_BACKEND"] = "fake"
+    os.environ["AI_FAKE_LATENCY"] = str(args.ai_latency)
+    os.environ["AI_FAKE_TOKEN_DELAY"] = str(args.ai_token_delay)
+    os.environ.setdefault("DB_ECHO", "false")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("OLLAMA_HEALTH_INTERVAL", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(ordered: list[float], pct: float) -> float:
+    """nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: list[float], statuses: dict, wall: float) -> dict:
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+async def seed_history(args, user_ids: list[int]):
+    """meal history plus the matching daily summaries, bulk-inserted like generate_data.py"""
+    from db.db import engine
+    from generate_data import BatchWriter, insert_meal_history
+
+    async with engine.begin() as conn:
+        writer = BatchWriter(conn, 5000)
+        await insert_meal_history(writer, random.Random(args.seed), user_ids, args.meals_per_user, args.days)
+        await writer.flush()
+
+
+def build_request(name: str, i: int, run_id: str):
+    """(method, url, kwargs) for request number i of a scenario"""
+    today = date.today()
+    if name == "analyze_food":
+        return "POST", "/analyze_food", {"json": {"input_text": f"benchmark dish {run_id}-{i}"}}
+    if name == "analyze_food_cached":
+        return "POST", "/analyze_food", {"json": {"input_text": CACHED_FOODS[i % len(CACHED_FOODS)]}}
+    if name == "meals":
+        return "GET", "/meals", {"params": {"limit": 50}}
+    if name == "daily_summary":
+        return "GET", "/daily_summary", {}
+    if name == "daily_summary_range":
+        start = (today - timedelta(days=29)).isoformat()
+        return "GET", "/daily_summary/range", {"params": {"start_date": start, "end_date": today.isoformat()}}
+    if name == "profile_get":
+        return "GET", "/profile", {}
+    if name == "profile_update":
+        return "POST", "/profile", {"json": {"weight": 70 + i % 10, "target_weight": 65}}
+    if name == "generate_advice":
+        summary = {"total_calories": 1800 + i % 400, "total_protein": 80, "total_fat": 60, "total_carbs": 220}
+        return "POST", "/generate_advice", {"json": summary}
+    if name == "generate_meal_advice":
+        nutrition = {"calories": 500 + i % 300, "protein": 25, "fat": 15, "carbohydrates": 60}
+        return "POST", "/generate_meal_advice", {"json": {"input_text": f"lunch {i % 50}", "nutrition": nutrition}}
+    raise ValueError(f"unknown scenario: {name}")
+
+
+async def run_scenario(client, name: str, args, headers: list[dict], run_id: str) -> dict:
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counter = iter(range(args.requests))
+
+    async def worker():
+        for i in counter:
+            method, url, kwargs = build_request(name, i, run_id)
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers[i % len(headers)], **kwargs)
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """human-readable regressions of p95 latency or throughput beyond tolerance"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if base["p95_ms"] > 0 and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def main(args):
+    import httpx
+    import main as app_module
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario: {name}")
+
+    await app_module.create_missing_tables()
+    transport = httpx.ASGITransport(app=app_module.app)
+    run_id = datetime.now().strftime("%H%M%S")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers, user_ids = [], []
+        for n in range(args.users):
+            credentials = {"username": f"bench_{run_id}_{n}", "password": "bench-password"}
+            registered = await client.post("/register", json=credentials)
+            user_ids.append(registered.json()["user_id"])
+            token = (await client.post("/login", data=credentials)).json()["access_token"]
+            headers.append({"Authorization": f"Bearer {token}"})
+            await client.post("/profile", json={"height": 170, "weight": 72, "target_weight": 65, "age": 30},
+                              headers=headers[-1])
+        await seed_history(args, user_ids)
+
+        results = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "database": os.environ["DATABASE_URL"].split("://")[0],
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "users": args.users,
+                "meals_per_user": args.meals_per_user,
+                "ai_latency": args.ai_latency,
+            },
+            "scenarios": {},
+        }
+        print(f"{'scenario':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for name in scenarios:
+            summary = await run_scenario(client, name, args, headers, run_id)
+            results["scenarios"][name] = summary
+            print(f"{name:<22}{summary['throughput_rps']:>9}{summary['p50_ms']:>9}{summary['p95_ms']:>9}"
+                  f"{summary['p99_ms']:>9}{summary['errors']:>8}")
+    await app_module.shutdown_ai_client()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_environment(arguments)
+    sys.exit(asyncio.run(main(arguments)))
@@ -0,0 +1,88 @@
+#AI调用录制/回放：record模式把prompt和回复写入磁盘，replay模式离线按录制的延迟回放
+import hashlib
+import json
+import os
+import random
+from typing import Optional
+
+AI_CASSETTE_PATH = os.getenv(
+    "AI_CASSETTE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ai_cassette.jsonl")
+)
+AI_RECORD_BACKEND = os.getenv("AI_RECORD_BACKEND", "ollama")  # real backend called in record mode
+AI_REPLAY_LATENCY = os.getenv("AI_REPLAY_LATENCY", "recorded")  # "recorded" or fixed seconds
+AI_REPLAY_LATENCY_SCALE = float(os.getenv("AI_REPLAY_LATENCY_SCALE", "1.0"))  # e.g. 0.1 for fast runs
+AI_REPLAY_JITTER = float(os.getenv("AI_REPLAY_JITTER", "0.1"))  # +/- fraction of the latency
+AI_REPLAY_SEED = int(os.getenv("AI_REPLAY_SEED", "0"))
+
+
+def cassette_key(prompt: str, json_schema: Optional[dict]) -> str:
+    # the same normalization as the single-flight key: whitespace does not change the generation
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{int(json_schema is not None)}|{normalized}".encode("utf-8")).hexdigest()[:32]
+
+
+class CassetteStore:
+    """append-only JSON lines file of recorded replies, one line per prompt (last recording wins)"""
+
+    def __init__(self, path: str = AI_CASSETTE_PATH):
+        self.path = path
+        self._entries: Optional[dict[str, dict]] = None
+        self._rng = random.Random(AI_REPLAY_SEED)
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._entries[entry["key"]] = entry
+        return self._entries
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._load().get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, backend: str, model: str, response: str, latency: float, first_token: float):
+        entry = {
+            "key": key,
+            "backend": backend,
+            "model": model,
+            "latency": round(latency, 4),
+            "first_token": round(first_token, 4),
+            "response": response,
+        }
+        self._load()[key] = entry
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.recorded += 1
+
+    def replay_delay(self, recorded: Optional[float], default: float) -> float:
+        """synthetic latency: recorded (or fixed) seconds, scaled, with jitter from a seeded generator"""
+        if AI_REPLAY_LATENCY == "recorded":
+            base = recorded if recorded is not None else default
+        else:
+            base = float(AI_REPLAY_LATENCY)
+        jitter = self._rng.uniform(-AI_REPLAY_JITTER, AI_REPLAY_JITTER) if AI_REPLAY_JITTER > 0 else 0.0
+        return max(0.0, base * AI_REPLAY_LATENCY_SCALE * (1 + jitter))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries) if self._entries is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+        }
+
+
+cassette_store = CassetteStore()
@@ -1,6 +1,7 @@
 #设计数据库模型
 from sqlalchemy import (
-    Column, Integer, String, Float, ForeignKey, DateTime, JSON, Text, Boolean, Date
+    Column, Integer, String, Float, ForeignKey, DateTime, JSON, Text, Boolean, Date, Index,
+    select, func, inspect, cast, literal
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -25,6 +26,10 @@ class User(Base):
 class Meal(Base):
     """餐食记录表"""
     __tablename__ = "meals"
+    __table_args__ = (
+        # 按用户和时间分页查询（keyset分页）
+        Index("ix_meals_user_meal_time", "user_id", "meal_time"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     input_text = Column(Text, nullable=False)  # 用户原始描述
@@ -46,6 +51,10 @@ class Meal(Base):
 class DailySummary(Base):
     """每日营养汇总表"""
     __tablename__ = "daily_summary"
+    __table_args__ = (
+        # 每个用户每天一行，作为upsert的冲突目标
+        Index("uq_daily_summary_user_date", "user_id", "date", unique=True),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     date = Column(Date, nullable=False)  # 日期
@@ -77,17 +86,201 @@ class UserProfile(Base):
 
     user = relationship("User", back_populates="profile")
 
+class WeeklySummary(Base):
+    """每周营养汇总（周一开始），与每日汇总在同一事务中增量更新"""
+    __tablename__ = "weekly_summary"
+    __table_args__ = (
+        Index("uq_weekly_summary_user_week", "user_id", "period_start", unique=True),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period_start = Column(Date, nullable=False)  # 周一
+    total_calories = Column(Float, default=0.0)
+    total_protein = Column(Float, default=0.0)
+    total_fat = Column(Float, default=0.0)
+    total_carbs = Column(Float, default=0.0)
+    total_fiber = Column(Float, default=0.0)
+    total_sugar = Column(Float, default=0.0)
+    days_logged = Column(Integer, default=0)  # 有记录的天数
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MonthlySummary(Base):
+    """每月营养汇总，与每日汇总在同一事务中增量更新"""
+    __tablename__ = "monthly_summary"
+    __table_args__ = (
+        Index("uq_monthly_summary_user_month", "user_id", "period_start", unique=True),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period_start = Column(Date, nullable=False)  # 每月1日
+    total_calories = Column(Float, default=0.0)
+    total_protein = Column(Float, default=0.0)
+    total_fat = Column(Float, default=0.0)
+    total_carbs = Column(Float, default=0.0)
+    total_fiber = Column(Float, default=0.0)
+    total_sugar = Column(Float, default=0.0)
+    days_logged = Column(Integer, default=0)  # 有记录的天数
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+ROLLUP_MODELS = {"week": WeeklySummary, "month": MonthlySummary}
+
+def period_start(day: datetime.date, period: str) -> datetime.date:
+    """汇总周期的第一天：周一或每月1日"""
+    if period == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+class NutritionCache(Base):
+    """营养分析缓存表，按规范化后的输入文本缓存AI分析结果"""
+    __tablename__ = "nutrition_cache"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text_hash = Column(String(64), unique=True, nullable=False)  # 规范化文本的sha256，作为缓存键
+    normalized_text = Column(Text, nullable=False)  # 规范化后的食物描述，仅用于查看
+    nutrition = Column(Text, nullable=False)  # 营养数据JSON字符串
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+SUMMARY_TOTAL_COLUMNS = [
+    "total_calories", "total_protein", "total_fat", "total_carbs", "total_fiber", "total_sugar"
+]
+
+def _merge_duplicate_daily_summaries(sync_conn):
+    """合并重复的(user_id, date)汇总行，唯一索引建立前调用"""
+    table = DailySummary.__table__
+    duplicates = sync_conn.execute(
+        select(table.c.user_id, table.c.date)
+        .group_by(table.c.user_id, table.c.date)
+        .having(func.count() > 1)
+    ).all()
+    for user_id, day in duplicates:
+        rows = sync_conn.execute(
+            select(table).where(table.c.user_id == user_id, table.c.date == day).order_by(table.c.id)
+        ).all()
+        totals = {col: sum(getattr(row, col) or 0 for row in rows) for col in SUMMARY_TOTAL_COLUMNS}
+        sync_conn.execute(table.update().where(table.c.id == rows[0].id).values(**totals))
+        sync_conn.execute(table.delete().where(table.c.id.in_([row.id for row in rows[1:]])))
+
+def _period_start_sql(sync_conn, column, period: str):
+    """SQL版本的period_start，用于回填"""
+    if sync_conn.dialect.name == "postgresql":
+        return cast(func.date_trunc(period, column), Date)
+    if period == "week":
+        # strftime('%w')：周日为0，换算成距周一的天数
+        offset = (cast(func.strftime("%w", column), Integer) + 6) % 7
+        return func.date(column, literal("-").concat(cast(offset, String)).concat(" days"))
+    return func.date(column, "start of month")
+
+def _backfill_rollups(sync_conn):
+    """汇总表为空时（新建表）从每日汇总一次性回填"""
+    daily = DailySummary.__table__
+    for period, model in ROLLUP_MODELS.items():
+        table = model.__table__
+        if sync_conn.execute(select(table.c.id).limit(1)).first() is not None:
+            continue
+        start = _period_start_sql(sync_conn, daily.c.date, period)
+        rows = select(
+            daily.c.user_id, start,
+            *[func.sum(func.coalesce(daily.c[col], 0.0)) for col in SUMMARY_TOTAL_COLUMNS],
+            func.count(), func.max(daily.c.created_at)
+        ).group_by(daily.c.user_id, start)
+        sync_conn.execute(table.insert().from_select(
+            ["user_id", "period_start", *SUMMARY_TOTAL_COLUMNS, "days_logged", "updated_at"], rows
+        ))
+
+def upgrade_schema(sync_conn):
+    """为旧数据库补充后来新增的索引（create_all不会给已存在的表建索引），并回填新建的周/月汇总表"""
+    if "text_hash" not in {column["name"] for column in inspect(sync_conn).get_columns("nutrition_cache")}:
+        # 旧缓存表以截断的文本为键，只是缓存，直接重建
+        NutritionCache.__table__.drop(sync_conn)
+        NutritionCache.__table__.create(sync_conn)
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "uq_daily_summary_user_date":
+                _merge_duplicate_daily_summaries(sync_conn)
+            index.create(sync_conn)
+    _backfill_rollups(sync_conn)
+
 #创建数据库引擎，配置数据库连接
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import event
 
 import os
 
+# 引擎配置：dev（默认，打印SQL）、prod（SQLite WAL + pragma）、postgres（asyncpg连接池）
+DB_PROFILE = os.getenv("DB_PROFILE", "dev")
+
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
-    "sqlite+aiosqlite:///./nutricoach.db"  # 改名为nutricoach.db
+    "postgresql+asyncpg://postgres@localhost:5432/nutricoach" if DB_PROFILE == "postgres"
+    else "sqlite+aiosqlite:///./nutricoach.db"  # 改名为nutricoach.db
 )
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+DB_ECHO = os.getenv("DB_ECHO", "true" if DB_PROFILE == "dev" else "false").lower() == "true"
+
+# 连接池
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20" if DB_PROFILE == "postgres" else "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10" if DB_PROFILE == "postgres" else "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 秒
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 秒
+
+# SQLite pragma（prod）
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 字节
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 负数单位为KiB，即64MB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # 毫秒
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新的aiosqlite连接：WAL模式让读不再被写阻塞"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+def create_engine_for_profile(url: str = DATABASE_URL, profile: str = DB_PROFILE):
+    """按配置创建异步引擎"""
+    if profile == "dev":
+        return create_async_engine(url, echo=DB_ECHO)
+    pool_options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if url.startswith("sqlite"):
+        new_engine = create_async_engine(
+            url, echo=DB_ECHO, connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000}, **pool_options
+        )
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return new_engine
+    # PostgreSQL（asyncpg）：pre_ping丢弃被服务端关闭的连接
+    return create_async_engine(url, echo=DB_ECHO, pool_pre_ping=True, **pool_options)
+
+engine = create_engine_for_profile()
 AsyncSessionLocal = async_sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+
+def period_index(session, column, period: str):
+    """周期的连续编号（周或月），相邻周期相差1；缺失的周期也占一个编号，供RANGE窗口使用"""
+    if session.get_bind().dialect.name == "postgresql":
+        if period == "week":
+            return (column - literal(datetime.date(1970, 1, 5))) / 7  # 1970-01-05是周一
+        return func.extract("year", column) * 12 + func.extract("month", column)
+    if period == "week":
+        return cast((func.julianday(column) - func.julianday("1970-01-05")) / 7, Integer)
+    return cast(func.strftime("%Y", column), Integer) * 12 + cast(func.strftime("%m", column), Integer)
+
+def dialect_insert(session, table):
+    """返回当前方言的insert构造，支持on_conflict_do_update（SQLite和PostgreSQL）"""
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
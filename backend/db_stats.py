@@ -0,0 +1,225 @@
+#数据库统计与行检查：只用聚合查询（COUNT/SUM/MIN/MAX、分位数），逐行查看走流式游标，内存占用与表大小无关
+"""
+admin statistics and row inspection for the NutriCoach database
+
+    python db_stats.py                                   # counts, aggregates, per-user percentiles, sizes
+    python db_stats.py rows meals --user-id 3 --since 2026-01-01 --limit 20
+    python db_stats.py rows daily_summary --format jsonl --limit 0 > summaries.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DB_ECHO", "false")
+
+from db.db import engine, User, Meal, DailySummary, UserProfile, NutritionCache, WeeklySummary, MonthlySummary
+from sqlalchemy import Date, select, func, text
+from sqlalchemy.exc import DBAPIError
+
+TABLES = {
+    "users": (User, User.created_at),
+    "user_profiles": (UserProfile, UserProfile.updated_at),
+    "meals": (Meal, Meal.meal_time),
+    "daily_summary": (DailySummary, DailySummary.date),
+    "weekly_summary": (WeeklySummary, WeeklySummary.period_start),
+    "monthly_summary": (MonthlySummary, MonthlySummary.period_start),
+    "nutrition_cache": (NutritionCache, NutritionCache.updated_at),
+}
+HIDDEN_COLUMNS = {"password_hash"}
+PERCENTILES = [50, 90, 99]
+
+
+async def table_counts(conn) -> dict:
+    """row count per table, one COUNT(*) each"""
+    return {
+        name: await conn.scalar(select(func.count()).select_from(model.__table__))
+        for name, (model, _) in TABLES.items()
+    }
+
+
+async def table_aggregates(conn) -> dict:
+    """date ranges and totals computed in the database"""
+    meals = (await conn.execute(select(
+        func.min(Meal.meal_time), func.max(Meal.meal_time),
+        func.sum(Meal.calories), func.avg(Meal.calories),
+        func.count(func.distinct(Meal.user_id)),
+        func.count() - func.count(Meal.calories),
+    ))).one()
+    summaries = (await conn.execute(select(
+        func.min(DailySummary.date), func.max(DailySummary.date),
+        func.sum(DailySummary.total_calories), func.avg(DailySummary.total_calories),
+    ))).one()
+    users = (await conn.execute(select(func.min(User.created_at), func.max(User.created_at)))).one()
+    return {
+        "meals": {
+            "first": meals[0], "last": meals[1], "total_calories": meals[2], "avg_calories": meals[3],
+            "users_with_meals": meals[4], "missing_calories": meals[5],
+        },
+        "daily_summary": {
+            "first": summaries[0], "last": summaries[1],
+            "total_calories": summaries[2], "avg_calories_per_day": summaries[3],
+        },
+        "users": {"first_signup": users[0], "last_signup": users[1]},
+    }
+
+
+async def distribution(conn, values) -> dict:
+    """percentiles of a one-column subquery: percentile_cont on PostgreSQL, one sorted streaming pass elsewhere"""
+    column = values.subquery().c[0]
+    if conn.dialect.name == "postgresql":
+        row = (await conn.execute(select(*[
+            func.percentile_cont(p / 100).within_group(column) for p in PERCENTILES
+        ], func.max(column)))).one()
+        return {**{f"p{p}": value for p, value in zip(PERCENTILES, row)}, "max": row[-1]}
+
+    count = await conn.scalar(select(func.count()).select_from(column.table))
+    if not count:
+        return {}
+    ranks = {max(0, round(p / 100 * count + 0.5) - 1): f"p{p}" for p in PERCENTILES}  # nearest rank
+    result = {}
+    stream = await conn.stream(select(column).order_by(column).execution_options(yield_per=10000))
+    index = 0
+    async for (value,) in stream:
+        if index in ranks:
+            result[ranks[index]] = value
+        index += 1
+    result["max"] = value
+    return result
+
+
+async def per_user_distributions(conn) -> dict:
+    return {
+        "meals per user": await distribution(
+            conn, select(func.count().label("n")).select_from(Meal).group_by(Meal.user_id)),
+        "logged days per user": await distribution(
+            conn, select(func.count().label("n")).select_from(DailySummary).group_by(DailySummary.user_id)),
+        "calories per logged day": await distribution(conn, select(DailySummary.total_calories)),
+        "calories per meal": await distribution(conn, select(Meal.calories).where(Meal.calories.isnot(None))),
+    }
+
+
+async def storage_sizes(conn) -> list[tuple[str, str, int]]:
+    """(name, table/index, bytes) largest first; empty when the database does not expose sizes"""
+    if conn.dialect.name == "postgresql":
+        query = text(
+            "SELECT c.relname, CASE c.relkind WHEN 'i' THEN 'index' ELSE 'table' END, pg_relation_size(c.oid) "
+            "FROM pg_class c WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind IN ('r', 'i') "
+            "ORDER BY 3 DESC"
+        )
+    elif conn.dialect.name == "sqlite":
+        # dbstat needs SQLITE_ENABLE_DBSTAT_VTAB, which most builds have
+        query = text(
+            "SELECT s.name, COALESCE(m.type, 'table'), SUM(s.pgsize) FROM dbstat s "
+            "LEFT JOIN sqlite_master m ON m.name = s.name GROUP BY s.name ORDER BY 3 DESC"
+        )
+    else:
+        return []
+    try:
+        return [tuple(row) for row in await conn.execute(query)]
+    except DBAPIError:
+        return []
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.1f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
+
+
+async def show_stats():
+    async with engine.connect() as conn:
+        print("\ndatabase statistics:")
+        for name, count in (await table_counts(conn)).items():
+            print(f"  {name:<18}{count:>14,} records")
+
+        for table, values in (await table_aggregates(conn)).items():
+            print(f"\n{table}:")
+            for key, value in values.items():
+                print(f"  {key:<24}{_format(value)}")
+
+        print("\nper-user distributions:")
+        print(f"  {'':<26}" + "".join(f"{f'p{p}':>12}" for p in PERCENTILES) + f"{'max':>12}")
+        for name, values in (await per_user_distributions(conn)).items():
+            print(f"  {name:<26}" + "".join(f"{_format(values.get(f'p{p}', '-')):>12}" for p in PERCENTILES)
+                  + f"{_format(values.get('max', '-')):>12}")
+
+        sizes = await storage_sizes(conn)
+        if sizes:
+            print("\nstorage:")
+            for name, kind, size in sizes:
+                print(f"  {name:<36}{kind:<7}{size / 1024 / 1024:>10.2f} MB")
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+async def stream_rows(args):
+    """print matching rows as they arrive; yield_per keeps one batch in memory"""
+    model, time_column = TABLES[args.table]
+    columns = [c for c in model.__table__.columns if c.name not in HIDDEN_COLUMNS]
+    if args.columns:
+        wanted = args.columns.split(",")
+        columns = [c for c in columns if c.name in wanted]
+    stmt = select(*columns)
+    if args.user_id is not None:
+        if "user_id" not in model.__table__.c:
+            raise SystemExit(f"{args.table} has no user_id column")
+        stmt = stmt.where(model.__table__.c.user_id == args.user_id)
+    as_date = isinstance(time_column.type, Date)
+    if args.since:
+        stmt = stmt.where(time_column >= (args.since.date() if as_date else args.since))
+    if args.until:
+        stmt = stmt.where(time_column < (args.until.date() if as_date else args.until))
+    stmt = stmt.order_by(model.__table__.c.id)
+    if args.limit:
+        stmt = stmt.limit(args.limit)
+
+    shown = 0
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=args.batch_size))
+        async for row in result:
+            values = row._asdict()
+            if args.format == "jsonl":
+                print(json.dumps(values, default=str, ensure_ascii=False))
+            else:
+                print("  ".join(f"{key}={value}" for key, value in values.items()))
+            shown += 1
+    print(f"{shown} rows", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="NutriCoach database statistics and row inspection")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("stats", help="aggregate statistics (default)")
+    rows = commands.add_parser("rows", help="stream rows of one table")
+    rows.add_argument("table", choices=list(TABLES))
+    rows.add_argument("--user-id", type=int)
+    rows.add_argument("--since", type=_parse_time, help="ISO date/time, inclusive")
+    rows.add_argument("--until", type=_parse_time, help="ISO date/time, exclusive")
+    rows.add_argument("--limit", type=int, default=100, help="0 for no limit")
+    rows.add_argument("--columns", help="comma-separated subset of columns")
+    rows.add_argument("--format", choices=["text", "jsonl"], default="text")
+    rows.add_argument("--batch-size", type=int, default=1000, help="rows fetched per round trip")
+    return parser.parse_args()
+
+
+async def main(args):
+    try:
+        if args.command == "rows":
+            await stream_rows(args)
+        else:
+            await show_stats()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,73 @@
+#确定性的假AI后端：用于压测和离线开发，回复只取决于prompt，延迟可配置
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import AsyncIterator, Optional
+
+AI_FAKE_LATENCY = float(os.getenv("AI_FAKE_LATENCY", "0.05"))  # seconds before the reply (time to first token)
+AI_FAKE_TOKEN_DELAY = float(os.getenv("AI_FAKE_TOKEN_DELAY", "0.002"))  # seconds between streamed tokens
+
+_ADVICE_POINTS = [
+    "Add a portion of vegetables to your next meal",
+    "Choose water or unsweetened tea instead of sugary drinks",
+    "Keep protein in every meal to stay full longer",
+    "Swap refined grains for whole grains when you can",
+    "Watch portion sizes of fried and high-fat foods",
+    "Include a piece of fruit as an afternoon snack",
+]
+_BATCH_ITEM_RE = re.compile(r"^\d+\. ", re.MULTILINE)
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def fake_nutrition(text: str) -> dict:
+    """plausible, deterministic nutrition values for a food description"""
+    seed = _seed(text)
+    calories = 100 + seed % 700
+    return {
+        "calories": calories,
+        "protein": round(calories * (0.05 + (seed >> 8) % 10 / 100) / 4, 1),
+        "fat": round(calories * (0.2 + (seed >> 12) % 15 / 100) / 9, 1),
+        "carbohydrates": round(calories * 0.5 / 4, 1),
+        "fiber": (seed >> 16) % 8,
+        "sugar": (seed >> 20) % 20,
+        "sodium": 50 + (seed >> 24) % 900,
+        "vitamins": {"vitamin_a": 0, "vitamin_c": (seed >> 28) % 30, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0},
+        "minerals": {"iron": (seed >> 32) % 5, "calcium": (seed >> 36) % 200, "zinc": 0, "magnesium": 0},
+    }
+
+
+def fake_reply(prompt: str, json_schema: Optional[dict] = None) -> str:
+    """nutrition JSON (object or array) for analysis prompts, three advice points otherwise"""
+    if "JSON array" in prompt:
+        count = len(_BATCH_ITEM_RE.findall(prompt)) or 1
+        return json.dumps([fake_nutrition(f"{prompt}#{i}") for i in range(count)])
+    if json_schema is not None or "JSON" in prompt:
+        return json.dumps(fake_nutrition(prompt))
+    seed = _seed(prompt)
+    points = [_ADVICE_POINTS[(seed + i) % len(_ADVICE_POINTS)] for i in range(3)]
+    return "\n".join(f"- {point}." for point in points)
+
+
+def split_tokens(text: str) -> list[str]:
+    """word-sized tokens that join back to text"""
+    return _TOKEN_RE.findall(text)
+
+
+async def fake_generate(prompt: str, json_schema: Optional[dict] = None) -> str:
+    await asyncio.sleep(AI_FAKE_LATENCY)
+    return fake_reply(prompt, json_schema)
+
+
+async def fake_stream(prompt: str, json_schema: Optional[dict] = None) -> AsyncIterator[str]:
+    """the same reply split into word-sized tokens"""
+    await asyncio.sleep(AI_FAKE_LATENCY)
+    for token in split_tokens(fake_reply(prompt, json_schema)):
+        if AI_FAKE_TOKEN_DELAY > 0:
+            await asyncio.sleep(AI_FAKE_TOKEN_DELAY)
+        yield token
@@ -0,0 +1,179 @@
+#本地食物成分表：内存索引 + n-gram模糊匹配，常见食物不用调用AI
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from nutrition_cache import normalize_food_text, strip_filler
+
+LOCAL_FOOD_ENABLED = os.getenv("LOCAL_FOOD_ENABLED", "true").lower() == "true"
+LOCAL_FOOD_TABLE_PATH = os.getenv(
+    "LOCAL_FOOD_TABLE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "food_composition.json")
+)
+LOCAL_FOOD_MIN_SCORE = float(os.getenv("LOCAL_FOOD_MIN_SCORE", "0.8"))  # bigram jaccard similarity, 1.0 = exact
+
+NUTRIENT_KEYS = ["calories", "protein", "fat", "carbohydrates", "fiber", "sugar", "sodium"]
+VITAMIN_KEYS = ["vitamin_a", "vitamin_c", "vitamin_d", "vitamin_e", "vitamin_b12"]
+MINERAL_KEYS = ["iron", "calcium", "zinc", "magnesium"]
+
+# several foods in one description: "rice and tofu", "米饭和豆腐"
+_SEPARATOR_RE = re.compile(r",|;|\+|&|、|\band\b|\bwith\b|和|还有|以及|加上")
+_GRAMS_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(kg|grams|gram|g|ml|千克|公斤|克|毫升|斤)(?![a-z])")
+_UNIT_GRAMS = {"kg": 1000, "千克": 1000, "公斤": 1000, "斤": 500}
+# "2% milk" is a kind of milk, not two servings
+_COUNT_RE = re.compile(r"(?<![\d.])(\d+(?:\.\d+)?)(?![\d.])(?!\s*%)")
+_EN_COUNT_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "half": 0.5, "couple": 2}
+_EN_COUNT_RE = re.compile(r"\b(" + "|".join(_EN_COUNT_WORDS) + r")\b")
+_ZH_DIGITS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "半": 0.5}
+_ZH_MEASURE = "个支根碗杯片块份只瓶盒袋串颗条张盘勺"
+_ZH_COUNT_RE = re.compile(
+    r"^([一二两三四五六七八九十半]+)[" + _ZH_MEASURE + r"]?|([一二两三四五六七八九十半]+)[" + _ZH_MEASURE + r"]"
+)
+_MEASURE_RE = re.compile(
+    r"\b(?:bowls?|cups?|glass(?:es)?|slices?|pieces?|plates?|servings?|portions?|bars?|cans?|bottles?"
+    r"|scoops?|handful|some|of)\b|[" + _ZH_MEASURE + r"]"
+)
+
+
+def _zh_number(text: str) -> float:
+    """parse small Chinese numerals: 一, 两, 十二, 二十, 半"""
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return _ZH_DIGITS.get(tens, 1) * 10 + _ZH_DIGITS.get(ones, 0)
+    return _ZH_DIGITS.get(text, 1)
+
+
+def _singular(text: str) -> str:
+    # crude plural folding, applied to both index and query so they stay consistent
+    return " ".join(w[:-1] if len(w) > 3 and w.endswith("s") else w for w in text.split())
+
+
+def _ngrams(text: str, n: int = 2) -> set:
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def _similarity(a: set, b: set) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def _words_in_order(query: str, alias: str) -> bool:
+    """query words found in the alias appear in the same order ("chocolate milk" is not "milk chocolate")"""
+    alias_words = [_ngrams(word) for word in alias.split()]
+    last = -1
+    for word in query.split():
+        grams = _ngrams(word)
+        scores = [_similarity(grams, alias_grams) for alias_grams in alias_words]
+        best = max(range(len(scores)), key=scores.__getitem__, default=None)
+        if best is None or scores[best] < 0.5:
+            continue
+        if best <= last:
+            return False
+        last = best
+    return True
+
+
+def parse_quantity(segment: str) -> tuple[str, Optional[float], Optional[float]]:
+    """split a lowercased segment into (food name, grams, count)"""
+    grams = count = None
+    match = _GRAMS_RE.search(segment)
+    if match:
+        grams = float(match.group(1)) * _UNIT_GRAMS.get(match.group(2), 1)
+        segment = segment[:match.start()] + " " + segment[match.end():]
+    else:
+        match = _COUNT_RE.search(segment) or _EN_COUNT_RE.search(segment)
+        if match:
+            word = match.group(1)
+            count = float(_EN_COUNT_WORDS.get(word, 0) or word)
+            segment = segment[:match.start()] + " " + segment[match.end():]
+        else:
+            match = _ZH_COUNT_RE.search(segment)
+            if match:
+                count = _zh_number(match.group(1) or match.group(2))
+                segment = segment[:match.start()] + " " + segment[match.end():]
+    name = " ".join(_MEASURE_RE.sub(" ", segment).split())
+    return name, grams, count
+
+
+class FoodIndex:
+    """in-memory food composition index with exact and n-gram fuzzy lookup"""
+
+    def __init__(self, foods: list[dict]):
+        self.foods = foods
+        self._exact: dict[str, int] = {}
+        self._aliases: list[tuple[str, set, int]] = []  # (alias, ngrams, food index)
+        self._postings: dict[str, set] = defaultdict(set)  # ngram -> alias ids
+        for food_id, food in enumerate(foods):
+            for alias in [food["name"], *food.get("synonyms", [])]:
+                key = _singular(normalize_food_text(alias))
+                if not key or key in self._exact:
+                    continue
+                self._exact[key] = food_id
+                grams = _ngrams(key)
+                alias_id = len(self._aliases)
+                self._aliases.append((key, grams, food_id))
+                for gram in grams:
+                    self._postings[gram].add(alias_id)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_FOOD_TABLE_PATH) -> "FoodIndex":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def match(self, name: str) -> tuple[Optional[dict], float]:
+        """best matching food for a bare food name and its similarity score"""
+        key = _singular(name)
+        if not key:
+            return None, 0.0
+        if key in self._exact:
+            return self.foods[self._exact[key]], 1.0
+        grams = _ngrams(key)
+        candidates = set()
+        for gram in grams:
+            candidates |= self._postings.get(gram, set())
+        best_food, best_score = None, 0.0
+        for alias_id in candidates:
+            alias, alias_grams, food_id = self._aliases[alias_id]
+            score = _similarity(grams, alias_grams)
+            # bigram sets ignore word order, so a swapped alias is only a match if the words line up
+            if score > best_score and _words_in_order(key, alias):
+                best_food, best_score = self.foods[food_id], score
+        return best_food, best_score
+
+    def analyze(self, input_text: str, min_score: float = LOCAL_FOOD_MIN_SCORE) -> Optional[dict]:
+        """
+            nutrition for a description made only of confidently matched foods,
+            None when any part needs the AI
+        """
+        text = strip_filler(unicodedata.normalize("NFKC", input_text).lower())
+        segments = [segment.strip() for segment in _SEPARATOR_RE.split(text) if segment.strip()]
+        if not segments:
+            return None
+        totals = {key: 0.0 for key in NUTRIENT_KEYS}
+        vitamins = {key: 0.0 for key in VITAMIN_KEYS}
+        minerals = {key: 0.0 for key in MINERAL_KEYS}
+        for segment in segments:
+            name, grams, count = parse_quantity(segment)
+            food, score = self.match(normalize_food_text(name))
+            if food is None or score < min_score:
+                return None
+            if grams is None:
+                grams = (count if count is not None else 1) * food["serving_grams"]
+            factor = grams / 100
+            for key in NUTRIENT_KEYS:
+                totals[key] += food["per_100g"].get(key, 0) * factor
+            for key, value in food.get("vitamins", {}).items():
+                vitamins[key] = vitamins.get(key, 0.0) + value * factor
+            for key, value in food.get("minerals", {}).items():
+                minerals[key] = minerals.get(key, 0.0) + value * factor
+        result = {key: round(value, 1) for key, value in totals.items()}
+        result["vitamins"] = {key: round(value, 2) for key, value in vitamins.items()}
+        result["minerals"] = {key: round(value, 2) for key, value in minerals.items()}
+        return result
+
+
+food_index = FoodIndex.load() if LOCAL_FOOD_ENABLED else None
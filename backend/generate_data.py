@@ -0,0 +1,224 @@
+#批量生成合成数据：N个用户（含健康档案）× M条餐食，并写入一致的每日/周/月汇总，用于规模测试
+"""
+bulk synthetic dataset for scale testing
+
+    python generate_data.py --users 10000 --meals-per-user 300 --days 180
+    python generate_data.py --users 1000 --database-url postgresql+asyncpg://postgres@localhost/nutricoach
+
+rows go in with Core executemany batches inside one transaction per --commit-every users,
+daily_summary and weekly/monthly_summary rows are the exact sums of the generated meals
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+# 餐次：(名称, 权重, 平均时间(分钟), 时间标准差(分钟), 平均热量kcal)
+MEAL_SLOTS = [
+    ("breakfast", 0.25, 7 * 60 + 30, 45, 420),
+    ("lunch", 0.30, 12 * 60 + 30, 40, 680),
+    ("snack", 0.15, 15 * 60 + 30, 120, 220),
+    ("dinner", 0.30, 19 * 60, 60, 760),
+]
+FOODS = {
+    "breakfast": ["oatmeal with banana", "two boiled eggs and toast", "yogurt with granola", "豆浆油条", "包子和小米粥",
+                  "pancakes with syrup", "avocado toast", "bagel with cream cheese"],
+    "lunch": ["chicken sandwich", "beef noodle soup", "caesar salad", "宫保鸡丁盖饭", "sushi set",
+              "burrito bowl", "ham and cheese panini", "番茄炒蛋和米饭"],
+    "snack": ["an apple", "a chocolate bar", "mixed nuts", "一支雪糕", "potato chips", "a protein shake",
+              "a latte and a cookie", "greek yogurt"],
+    "dinner": ["grilled salmon with rice", "spaghetti bolognese", "pepperoni pizza", "红烧肉和青菜", "chicken curry",
+               "steak and fries", "tofu stir fry", "麻辣香锅"],
+}
+SLOT_WEIGHTS = [slot[1] for slot in MEAL_SLOTS]
+SUMMARY_KEYS = ["total_calories", "total_protein", "total_fat", "total_carbs", "total_fiber", "total_sugar"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="generate a synthetic NutriCoach dataset with bulk inserts")
+    parser.add_argument("--users", type=int, default=1000, help="users to create (each with a health profile)")
+    parser.add_argument("--meals-per-user", type=int, default=300, help="meals per user")
+    parser.add_argument("--days", type=int, default=180, help="days of history ending today")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per executemany batch")
+    parser.add_argument("--commit-every", type=int, default=1000, help="users per transaction")
+    parser.add_argument("--prefix", default="synthetic_", help="username prefix, must not collide with existing users")
+    parser.add_argument("--password", default="test123", help="password of every generated user")
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL / the configured database")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # db.db reads its settings at import time, so this must run first
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("DB_ECHO", "false")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_row(rng: random.Random, user_id: int) -> dict:
+    gender = rng.choice(["male", "female", "male", "female", "other"])
+    height = rng.gauss(176 if gender == "male" else 163, 7)
+    bmi = min(45.0, max(16.0, rng.lognormvariate(math.log(24), 0.15)))
+    weight = bmi * (height / 100) ** 2
+    return {
+        "user_id": user_id,
+        "height": round(height, 1),
+        "weight": round(weight, 1),
+        "target_weight": round(weight * rng.uniform(0.85, 1.0), 1),
+        "is_vegetarian": rng.random() < 0.1,
+        "allergies": rng.choice(["", "", "", "", "peanut", "seafood", "lactose", "gluten"]),
+        "chronic_diseases": rng.choice(["", "", "", "", "", "hypertension", "diabetes"]),
+        "age": rng.randint(18, 75),
+        "gender": gender,
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def meal_row(rng: random.Random, user_id: int, day: date, appetite: float) -> dict:
+    """one meal: slot-dependent time and calories (log-normal), macros from a random energy split"""
+    name, _, mean_minute, sd_minute, mean_calories = rng.choices(MEAL_SLOTS, SLOT_WEIGHTS)[0]
+    minute = min(1439, max(0, int(rng.gauss(mean_minute, sd_minute))))
+    calories = round(mean_calories * appetite * rng.lognormvariate(0, 0.35), 1)
+    protein_share, fat_share = rng.uniform(0.12, 0.3), rng.uniform(0.2, 0.4)
+    carbohydrates = round(calories * (1 - protein_share - fat_share) / 4, 1)
+    nutrition = {
+        "calories": calories,
+        "protein": round(calories * protein_share / 4, 1),
+        "fat": round(calories * fat_share / 9, 1),
+        "carbohydrates": carbohydrates,
+        "fiber": round(carbohydrates * rng.uniform(0.02, 0.12), 1),
+        "sugar": round(carbohydrates * rng.uniform(0.05, 0.4), 1),
+        "sodium": round(calories * rng.uniform(0.8, 2.5)),
+    }
+    return {
+        "user_id": user_id,
+        "input_text": rng.choice(FOODS[name]),
+        **nutrition,
+        "vitamins": '{"vitamin_c": %d}' % rng.randrange(40),
+        "minerals": '{"iron": %d, "calcium": %d}' % (rng.randrange(6), rng.randrange(300)),
+        "gpt_raw_response": json.dumps(nutrition),
+        "meal_time": datetime.combine(day, datetime.min.time()) + timedelta(minutes=minute, seconds=rng.randrange(60)),
+    }
+
+
+class BatchWriter:
+    """buffers rows per table and writes them with one executemany per batch_size rows"""
+
+    def __init__(self, conn, batch_size: int):
+        self.conn = conn
+        self.batch_size = batch_size
+        self._rows: dict = {}
+        self.written = 0
+
+    async def add(self, table, row: dict):
+        rows = self._rows.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            await self.flush(table)
+
+    async def flush(self, table=None):
+        from sqlalchemy import insert
+
+        for target in [table] if table is not None else list(self._rows):
+            rows = self._rows.pop(target, [])
+            if rows:
+                await self.conn.execute(insert(target), rows)
+                self.written += len(rows)
+
+
+async def insert_meal_history(writer: BatchWriter, rng: random.Random, user_ids: list[int],
+                              meals_per_user: int, days: int):
+    """meals for each user plus the daily_summary and weekly/monthly rollup rows that exactly match them"""
+    from db.db import Meal, DailySummary, ROLLUP_MODELS, period_start
+
+    today = date.today()
+    now = datetime.utcnow()
+    for user_id in user_ids:
+        appetite = rng.lognormvariate(0, 0.2)
+        totals: dict[date, list[float]] = {}
+        for _ in range(meals_per_user):
+            day = today - timedelta(days=rng.randrange(days))
+            row = meal_row(rng, user_id, day, appetite)
+            await writer.add(Meal.__table__, row)
+            day_totals = totals.setdefault(day, [0.0] * len(SUMMARY_KEYS))
+            for k, key in enumerate(("calories", "protein", "fat", "carbohydrates", "fiber", "sugar")):
+                day_totals[k] += row[key]
+        rollups: dict[tuple[str, date], list[float]] = {}
+        for day, values in totals.items():
+            await writer.add(DailySummary.__table__, {
+                "user_id": user_id, "date": day, "created_at": now, **dict(zip(SUMMARY_KEYS, values))
+            })
+            for period in ROLLUP_MODELS:
+                rollup = rollups.setdefault((period, period_start(day, period)), [0.0] * len(SUMMARY_KEYS) + [0])
+                for k, value in enumerate(values):
+                    rollup[k] += value
+                rollup[-1] += 1
+        for (period, start), values in rollups.items():
+            await writer.add(ROLLUP_MODELS[period].__table__, {
+                "user_id": user_id, "period_start": start, "updated_at": now,
+                **dict(zip(SUMMARY_KEYS, values)), "days_logged": values[-1]
+            })
+
+
+async def create_users(conn, writer: BatchWriter, rng: random.Random, names: list[str],
+                       password_hash: str, days: int) -> list[int]:
+    """insert users in bulk and return their ids in the order of names"""
+    from sqlalchemy import select
+    from db.db import User, UserProfile
+
+    joined = datetime.utcnow() - timedelta(days=days)
+    for name in names:
+        await writer.add(User.__table__, {
+            "username": name, "password_hash": password_hash, "email": f"{name}@example.com",
+            "created_at": joined - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+        })
+    await writer.flush(User.__table__)
+    # zero-padded names sort like their numbers, so one range scan on the username index finds the chunk
+    result = await conn.execute(
+        select(User.id, User.username).where(User.username.between(names[0], names[-1]))
+    )
+    ids = dict((username, user_id) for user_id, username in result)
+    user_ids = [ids[name] for name in names]
+    for user_id in user_ids:
+        await writer.add(UserProfile.__table__, profile_row(rng, user_id))
+    return user_ids
+
+
+async def main(args):
+    from db.db import engine, DATABASE_URL
+    from init_db import init_models
+
+    await init_models()
+    rng = random.Random(args.seed)
+    password_hash = hashlib.sha256(args.password.encode()).hexdigest()
+    width = len(str(max(args.users - 1, 0)))
+    print(f"generating {args.users} users x {args.meals_per_user} meals over {args.days} days "
+          f"into {DATABASE_URL.split('://')[0]}")
+
+    start = time.perf_counter()
+    total = 0
+    for first in range(0, args.users, args.commit_every):
+        names = [f"{args.prefix}{n:0{width}d}" for n in range(first, min(args.users, first + args.commit_every))]
+        async with engine.begin() as conn:
+            writer = BatchWriter(conn, args.batch_size)
+            user_ids = await create_users(conn, writer, rng, names, password_hash, args.days)
+            await insert_meal_history(writer, rng, user_ids, args.meals_per_user, args.days)
+            await writer.flush()
+        total += writer.written
+        elapsed = time.perf_counter() - start
+        print(f"  {first + len(names)}/{args.users} users, {total} rows, {total / elapsed:.0f} rows/s")
+    await engine.dispose()
+    print(f"done: {total} rows in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_environment(arguments)
+    asyncio.run(main(arguments))
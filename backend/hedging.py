@@ -0,0 +1,81 @@
+#对冲请求：主调用超过近期延迟分位数仍未返回时，向备用后端发一个副本，先成功者胜出
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import hedge_requests
+
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "false").lower() == "true"
+AI_HEDGE_BACKEND = os.getenv("AI_HEDGE_BACKEND", "")  # secondary backend, empty = same backend (another ollama instance)
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))  # hedge once the primary is slower than this
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.5"))  # seconds, floor for the hedge delay
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))  # no hedging until this many latencies are known
+AI_HEDGE_WINDOW = int(os.getenv("AI_HEDGE_WINDOW", "500"))  # recent latencies kept per backend
+
+
+class HedgePolicy:
+    """fires a duplicate call after the primary exceeds its recent latency percentile"""
+
+    def __init__(self, secondary: str = AI_HEDGE_BACKEND, percentile: float = AI_HEDGE_PERCENTILE,
+                 min_delay: float = AI_HEDGE_MIN_DELAY, min_samples: int = AI_HEDGE_MIN_SAMPLES,
+                 window: int = AI_HEDGE_WINDOW):
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self._latencies: dict[str, deque] = {}
+
+    def record(self, backend: str, seconds: float):
+        samples = self._latencies.get(backend)
+        if samples is None:
+            samples = self._latencies[backend] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def delay(self, backend: str) -> Optional[float]:
+        """hedge delay for a backend, None while there are too few samples"""
+        samples = self._latencies.get(backend)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    async def _timed(self, backend: str, call: Callable[[str], Awaitable[Any]]):
+        start = time.perf_counter()
+        result = await call(backend)
+        self.record(backend, time.perf_counter() - start)
+        return result
+
+    async def run(self, backend: str, call: Callable[[str], Awaitable[Any]]) -> Any:
+        """call(backend), hedged with call(secondary) when the primary is slow; the loser is cancelled"""
+        primary = asyncio.ensure_future(self._timed(backend, call))
+        delay = self.delay(backend)
+        if delay is None:
+            return await primary
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+            hedge_requests.labels(backend, "fired").inc()
+            secondary = asyncio.ensure_future(self._timed(self.secondary or backend, call))
+            pending = {primary, secondary}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedge_requests.labels(backend, "won" if task is secondary else "lost").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # cancelling the loser closes its HTTP request, which stops that generation
+            for task in pending:
+                task.cancel()
+
+
+hedge_policy = HedgePolicy()
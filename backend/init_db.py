@@ -5,8 +5,7 @@ import os
 # 添加当前目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from db.db import engine, Base, User, Meal, DailySummary, UserProfile
-from sqlalchemy.future import select
+from db.db import engine, Base, User, Meal, DailySummary, UserProfile, upgrade_schema
 import datetime
 import hashlib
 
@@ -14,6 +13,7 @@ async def init_models():
     """Initialize database tables"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
     print("Database tables created successfully!")
 
 async def create_test_data():
@@ -129,18 +129,12 @@ async def create_test_data():
         print(f"Today's summary record created successfully!")
 
 async def show_database_info():
-    """显示数据库信息"""
-    from db.db import AsyncSessionLocal
+    """显示数据库信息（COUNT聚合，完整统计见db_stats.py）"""
+    from db_stats import table_counts
     
-    async with AsyncSessionLocal() as session:
-        # 统计各表记录数
-        tables = [User, UserProfile, Meal, DailySummary]
-        table_names = ["user", "health profile", "meal record", "daily summary"]
-        
+    async with engine.connect() as conn:
         print("\ndatabase statistics:")
-        for table, name in zip(tables, table_names):
-            result = await session.execute(select(table))
-            count = len(result.scalars().all())
+        for name, count in (await table_counts(conn)).items():
             print(f"  {name} table: {count} records")
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+#进程内后台任务队列：接口立即返回job id，固定数量的worker调用AI后端
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # concurrent AI generations for queued jobs
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))  # seconds a finished job stays retrievable
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))  # longest long-poll on GET /jobs/{id}
+
+
+class Job:
+    """one queued unit of work and its outcome"""
+
+    def __init__(self, user_id: int, payload: dict):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.payload = payload
+        self.status = "queued"  # queued -> running -> done | error
+        self.result: Optional[dict] = None
+        self.error: Optional[dict] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finished = asyncio.Event()
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """bounded asyncio queue drained by a fixed pool of workers running handler(job)"""
+
+    def __init__(self, handler: Callable[[Job], Awaitable[Any]], workers: int = JOB_WORKERS,
+                 max_size: int = JOB_QUEUE_SIZE, result_ttl: float = JOB_RESULT_TTL):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.result_ttl = result_ttl
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        """spawn the workers, called on app startup"""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user_id: int, payload: dict) -> Job:
+        """enqueue without waiting; raises 503 when the queue is full"""
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="job workers are not running")
+        self._prune()
+        job = Job(user_id, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="job queue is full, try again later")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, user_id: int) -> Optional[Job]:
+        """a job visible to this user, None for unknown ids and other users' jobs"""
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    async def wait(self, job: Job, timeout: float):
+        """long-poll: return when the job finishes or the timeout passes"""
+        if timeout > 0 and not job.finished.is_set():
+            try:
+                await asyncio.wait_for(job.finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.handler(job)
+                job.status = "done"
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.status = "error"
+                job.error = {"status_code": 503, "detail": "server shutting down"}
+                raise
+            except HTTPException as e:
+                job.status = "error"
+                job.error = {"status_code": e.status_code, "detail": e.detail}
+                self.failed += 1
+            except Exception as e:
+                job.status = "error"
+                job.error = {"status_code": 500, "detail": str(e)}
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                job.finished.set()
+                self._queue.task_done()
+
+    def _prune(self):
+        # jobs are kept in submission order, drop finished ones from the front once expired
+        cutoff = time.time() - self.result_ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.finished_at is None or job.finished_at > cutoff:
+                break
+            self._jobs.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "tracked": len(self._jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
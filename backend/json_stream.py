@@ -0,0 +1,56 @@
+#增量JSON提取：边接收token边跟踪括号/字符串状态，顶层对象一闭合就停止
+import json
+from typing import Optional
+
+
+class JsonObjectExtractor:
+    """
+        feed() streamed text; returns the first complete, parseable top-level JSON object
+        text before the object (and invalid brace groups like "{note}") is skipped
+    """
+
+    def __init__(self):
+        self._buffer: list[str] = []  # text of the object being collected
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.result: Optional[str] = None
+
+    def feed(self, chunk: str) -> Optional[str]:
+        if self.result is not None:
+            return self.result
+        for char in chunk:
+            if self._depth == 0:
+                if char == "{":
+                    self._buffer = ["{"]
+                    self._depth = 1
+                continue
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = "".join(self._buffer)
+                    try:
+                        json.loads(candidate)
+                    except json.JSONDecodeError:
+                        # not the object we want, keep scanning for the next "{"
+                        self._buffer = []
+                        continue
+                    self.result = candidate
+                    return candidate
+        return None
+
+    def partial(self) -> str:
+        """the unfinished object collected so far, for when the stream ends early"""
+        return "".join(self._buffer)
@@ -1,41 +1,67 @@
-from fastapi import FastAPI, HTTPException, Depends, Body
-from pydantic import BaseModel
-import openai
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
 import os
-import requests
 import json
 import re
-from db.db import AsyncSessionLocal, User, Meal, DailySummary
+from db.db import AsyncSessionLocal, User, Meal, DailySummary, Base, engine, dialect_insert, upgrade_schema, SUMMARY_TOTAL_COLUMNS, ROLLUP_MODELS, period_start, period_index
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 from sqlalchemy.future import select
+from sqlalchemy import func, or_, and_, case
 import datetime
 import hashlib
-from typing import Optional
+import asyncio
+import base64
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Optional
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, date
 from fastapi import APIRouter
 from db.db import UserProfile
+from ai_client import AI_BACKEND, get_ai_response, get_ai_json_response, stream_ai_response, close_http_client, ai_single_flight, ollama_pool
+from nutrition_cache import nutrition_cache, NUTRITION_CACHE_ENABLED
+from food_table import food_index
+from user_cache import user_context_cache, UserContext
+from cassette import cassette_store
+from admission import AdmissionRejected, RATE_LIMIT_BURST, RATE_LIMIT_ENABLED, user_rate_limiter, admission_stats
+from jobs import JobQueue, Job, JOB_MAX_WAIT
+from metrics import registry, MetricsMiddleware, instrument_engine, json_repair_attempts, nutrition_fallbacks
 
-# AI backend config
-AI_BACKEND = os.getenv("AI_BACKEND", "ollama")  # optional: "openai", "ollama", "huggingface"
+SECRET_KEY = "your_secret_key"  # use a more complex string
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
-# OpenAI config
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# batch analysis config
+BATCH_ANALYZE_MODE = os.getenv("BATCH_ANALYZE_MODE", "fanout")  # optional: "fanout", "packed"
+BATCH_ANALYZE_CONCURRENCY = int(os.getenv("BATCH_ANALYZE_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+# each food the AI analyzes costs one rate-limit token, so one batch can never need more than the bucket holds
+BATCH_MAX_AI_ITEMS = min(BATCH_MAX_ITEMS, int(RATE_LIMIT_BURST)) if RATE_LIMIT_ENABLED else BATCH_MAX_ITEMS
 
-# Ollama config
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
+# structured output: ask the backend for schema-constrained JSON and validate it instead of repairing it
+STRUCTURED_OUTPUT = os.getenv("AI_STRUCTURED_OUTPUT", "true").lower() == "true"
+STRUCTURED_OUTPUT_RETRIES = int(os.getenv("AI_STRUCTURED_OUTPUT_RETRIES", "2"))  # extra attempts after the first
 
-# HuggingFace config
-HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-HUGGINGFACE_MODEL = os.getenv("HUGGINGFACE_MODEL", "microsoft/DialoGPT-medium")
+# advice length budget, enforced while the reply streams in
+ADVICE_BOUNDED = os.getenv("ADVICE_BOUNDED", "false").lower() == "true"  # opt-in: replies become formatted points
+ADVICE_MAX_BULLETS = 3  # format_advice_points keeps at most three points
+ADVICE_MAX_WORDS = int(os.getenv("ADVICE_MAX_WORDS", "100"))
 
-SECRET_KEY = "your_secret_key"  # use a more complex string
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# meal history paging
+MEALS_MAX_PAGE_SIZE = int(os.getenv("MEALS_MAX_PAGE_SIZE", "200"))
+SUMMARY_RANGE_MAX_DAYS = int(os.getenv("SUMMARY_RANGE_MAX_DAYS", "366"))
+
+# trends over the weekly/monthly rollups
+TRENDS_DEFAULT_CALORIE_TARGET = float(os.getenv("TRENDS_DEFAULT_CALORIE_TARGET", "2000"))  # kcal/day without a usable profile
+TRENDS_TARGET_TOLERANCE = float(os.getenv("TRENDS_TARGET_TOLERANCE", "0.1"))  # +/- fraction of the target counted as on target
+
+# history export: rows fetched from the database cursor per chunk
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -44,6 +70,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 app = FastAPI(title="NutriCoach API", description="nutrition analysis API")
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine.sync_engine)
+
+@app.on_event("startup")
+async def create_missing_tables():
+    # create tables and indexes added after the database was initialized (e.g. nutrition_cache)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+@app.on_event("startup")
+async def start_ollama_health_checks():
+    if AI_BACKEND == "ollama":
+        ollama_pool.start_health_checks()
+
+@app.on_event("shutdown")
+async def shutdown_ai_client():
+    # release pooled keep-alive connections to the AI backends
+    await ollama_pool.stop_health_checks()
+    await close_http_client()
+
+@app.on_event("startup")
+async def start_job_workers():
+    food_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await food_jobs.stop()
 
 class UserRegister(BaseModel):
     username: str
@@ -57,6 +111,12 @@ class UserLogin(BaseModel):
 class FoodInput(BaseModel):
     input_text: str  # user's original description
 
+class BatchFoodItem(FoodInput):
+    meal_time: Optional[datetime] = None  # for backfilling history, defaults to now
+
+class BatchFoodInput(BaseModel):
+    items: list[BatchFoodItem]
+
 class NutritionResponse(BaseModel):
     calories: float
     protein: float
@@ -68,6 +128,33 @@ class NutritionResponse(BaseModel):
     vitamins: dict = {}  # vitamin information
     minerals: dict = {}  # mineral information
 
+class VitaminValues(BaseModel):
+    vitamin_a: float = Field(0, ge=0)
+    vitamin_c: float = Field(0, ge=0)
+    vitamin_d: float = Field(0, ge=0)
+    vitamin_e: float = Field(0, ge=0)
+    vitamin_b12: float = Field(0, ge=0)
+
+class MineralValues(BaseModel):
+    iron: float = Field(0, ge=0)
+    calcium: float = Field(0, ge=0)
+    zinc: float = Field(0, ge=0)
+    magnesium: float = Field(0, ge=0)
+
+class StructuredNutrition(NutritionResponse):
+    """NutritionResponse with typed vitamins/minerals, used as the JSON schema sent to the AI backend"""
+    calories: float = Field(ge=0)
+    protein: float = Field(ge=0)
+    fat: float = Field(ge=0)
+    carbohydrates: float = Field(ge=0)
+    fiber: float = Field(ge=0)
+    sugar: float = Field(ge=0)
+    sodium: float = Field(ge=0)
+    vitamins: VitaminValues = VitaminValues()
+    minerals: MineralValues = MineralValues()
+
+NUTRITION_JSON_SCHEMA = StructuredNutrition.model_json_schema()
+
 class ChangePasswordRequest(BaseModel):
     old_password: str
     new_password: str
@@ -80,6 +167,24 @@ def read_root():
         "ai_backend": AI_BACKEND
     }
 
+@app.get("/stats")
+def read_stats():
+    """runtime counters for caches and the AI call path"""
+    return {
+        "nutrition_cache": nutrition_cache.stats(),
+        "ai_single_flight": ai_single_flight.stats(),
+        "user_cache": user_context_cache.stats(),
+        "jobs": food_jobs.stats(),
+        "ollama": ollama_pool.stats(),
+        "admission": admission_stats(),
+        "cassette": cassette_store.stats()
+    }
+
+@app.get("/metrics")
+def read_metrics():
+    """request, database and AI latency histograms in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 #获取数据库会话
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -140,7 +245,8 @@ async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Async
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def get_current_user_context(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> UserContext:
+    """authenticated user plus profile, served from the per-process cache when fresh"""
     credentials_exception = HTTPException(status_code=401, detail="invalid credentials")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -149,67 +255,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
-    if user is None:
+    context = await user_context_cache.get(db, user_id)
+    if context is None:
         raise credentials_exception
-    print("user:", user)#debug
-    print("user.password_hash:", user.password_hash)#debug
-    print("type(user):", type(user))#debug
-    print("type(user.password_hash):", type(user.password_hash))#debug
-    return user
+    return context
 
-def get_ai_response(prompt: str, model: str = "ollama"):
-    """
-        unified AI call interface, support openai, ollama, huggingface
-    """
-    if model == "openai":
-        if not openai.api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API Key not set")
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=512
-            )
-            return response["choices"][0]["message"]["content"]
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
-    elif model == "ollama":
-        try:
-            response = requests.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.2,
-                        "num_predict": 300
-                    }
-                }
-            )
-            response.raise_for_status()
-            return response.json()["response"]
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
-    elif model == "huggingface":
-        if not HUGGINGFACE_API_KEY:
-            raise HTTPException(status_code=500, detail="HuggingFace API Key not set")
-        try:
-            response = requests.post(
-                f"https://api-inference.huggingface.co/models/{HUGGINGFACE_MODEL}",
-                headers={"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"},
-                json={"inputs": prompt}
-            )
-            response.raise_for_status()
-            return response.json()[0]["generated_text"]
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"HuggingFace API error: {str(e)}")
-    else:
-        raise HTTPException(status_code=500, detail=f"Unsupported AI backend: {model}")
+async def get_current_user(context: UserContext = Depends(get_current_user_context)):
+    return context.user
 
+async def enforce_ai_rate_limit(current_user: User = Depends(get_current_user)):
+    """per-user token bucket in front of the AI-backed endpoints, 429 with Retry-After when empty"""
+    if RATE_LIMIT_ENABLED:
+        user_rate_limiter.check(current_user.id)
 
 def format_advice_output(text: str, max_chars: int = 100) -> str:
     """clean AI output, format into points, and strictly limit the length."""
@@ -280,7 +337,175 @@ def format_advice_output_words(text: str, max_words: int = 100) -> str:
 
     return "\n".join(result_lines)
 
-@app.post("/analyze_food")
+# a point starts at a line break or a bullet marker; "2.5 cups" and "e.g." are not boundaries
+_ADVICE_MARKER_RE = re.compile(r"^\s*(?:([-*•])|\d{1,2}[.)])\s+")
+# a "* a * b" line holds several points, but " - " inside a line is a dash ("Breakfast - add eggs", "2 - 3 servings")
+_ADVICE_INLINE_MARKERS = {"*": re.compile(r"\s\*\s+"), "•": re.compile(r"\s•\s+")}
+
+def split_advice_points(text: str) -> list[str]:
+    """
+        advice split into points at line breaks and line-leading bullet markers ("- ", "* ", "• ", "1. "),
+        plus repeats of a "* "/"• " marker later in its own line, markers removed;
+        the last entry is the point still being written (possibly empty)
+    """
+    cleaned = text.replace("```", "").replace("\r\n", "\n")
+    points = []
+    for line in cleaned.split("\n"):
+        marker = _ADVICE_MARKER_RE.match(line)
+        if marker is None:
+            points.append(line)
+            continue
+        # inside a line only the marker that started it opens another point
+        rest = line[marker.end():]
+        inline = _ADVICE_INLINE_MARKERS.get(marker.group(1))
+        points.extend(inline.split(rest) if inline is not None else [rest])
+    return [" ".join(point.split()) for point in points]
+
+def _is_advice_point(point: str) -> bool:
+    # skip blank lines, a marker whose point has not started yet and intro lines such as "Here are some tips:"
+    return bool(point) and not _ADVICE_MARKER_RE.match(point + " ") and not point.endswith(":")
+
+def format_advice_points(text: str, max_words: int = ADVICE_MAX_WORDS) -> str:
+    """at most ADVICE_MAX_BULLETS points as "• " lines, max_words words in total"""
+    lines = []
+    remaining = max_words
+    for point in [p for p in split_advice_points(text) if _is_advice_point(p)][:ADVICE_MAX_BULLETS]:
+        if remaining <= 0:
+            break
+        words = point.split()[:remaining]
+        remaining -= len(words)
+        lines.append("• " + " ".join(words))
+    return "\n".join(lines)
+
+def advice_limit_reached(text: str, max_words: int = ADVICE_MAX_WORDS) -> bool:
+    """
+        True once more text can no longer change format_advice_points(text, max_words):
+        a marker or line break has closed the third point, or the points hold max_words complete words
+    """
+    points = split_advice_points(text)
+    # every point but the last has been closed by a boundary, the last one is still growing
+    closed = [point for point in points[:-1] if _is_advice_point(point)]
+    if len(closed) >= ADVICE_MAX_BULLETS:
+        return True
+    words = sum(len(point.split()) for point in closed)
+    current = points[-1]
+    if current:
+        words += len(current.split())
+        if not text[-1].isspace():
+            words -= 1  # the last word may still be incomplete
+    return words >= max_words
+
+async def generate_bounded_advice(prompt: str) -> AsyncIterator[str]:
+    """stream advice tokens, stopping the generation once the bullet or word budget is used up"""
+    chunks = []
+    stream = stream_ai_response(prompt, model=AI_BACKEND)
+    try:
+        async for token in stream:
+            chunks.append(token)
+            yield token
+            if advice_limit_reached("".join(chunks)):
+                break
+    finally:
+        # closing the upstream stream stops the model from generating the rest
+        await stream.aclose()
+
+async def get_bounded_advice(prompt: str) -> str:
+    """advice formatted to at most three points and ADVICE_MAX_WORDS words"""
+    chunks = [token async for token in generate_bounded_advice(prompt)]
+    return format_advice_points("".join(chunks), max_words=ADVICE_MAX_WORDS)
+
+def clean_ai_json(content: str) -> str:
+    """extract the JSON object from raw AI output and repair common format issues"""
+    json_repair_attempts.labels().inc()
+    # clean and extract JSON content
+    content = content.strip()
+
+    # remove possible markdown code block markers
+    if content.startswith('```json'):
+        content = content[7:]
+    elif content.startswith('```'):
+        content = content[3:]
+    if content.endswith('```'):
+        content = content[:-3]
+
+    # find JSON object
+    start = content.find('{')
+    end = content.rfind('}')
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+
+    # clean newlines and extra spaces
+    content = content.replace('\n', ' ').replace('\r', ' ')
+    content = re.sub(r'\s+', ' ', content)
+
+    # fix common JSON format issues
+    # 1. replace smart quotes to standard double quotes
+    content = content.replace('"', '"').replace('"', '"')
+    content = content.replace(''', "'").replace(''', "'")
+
+    # 2. remove possible non-printable characters
+    content = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', content)
+
+    # 3. fix cases where there are quotes but the format is incorrect
+    content = re.sub(r'""(\w+)"":', r'"\1":', content)
+
+    # 3. check and fix incomplete JSON
+    if not content.endswith('}'):
+        # if JSON is incomplete, try to complete the missing parts
+        open_braces = content.count('{')
+        close_braces = content.count('}')
+        missing_braces = open_braces - close_braces
+
+        # if minerals part is missing, add default values
+        if '"minerals"' not in content:
+            if content.endswith('"vitamins": { "vitamin_a": 0, "vitamin_c": 0, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0 }'):
+                content += ', "minerals": { "iron": 0, "calcium": 0, "zinc": 0, "magnesium": 0 }'
+
+        # complete missing braces
+        content += '}' * missing_braces
+
+    return content
+
+def build_nutrition_prompt(input_text: str) -> str:
+    """prompt asking the AI for one food's nutrition as a JSON object"""
+    return f"""
+Analyze the nutrition of the following food. Return ONLY a JSON object, no other text.
+
+Food: {input_text}
+
+Return format (numbers only, no text):
+{{"calories": number, "protein": number, "fat": number, "carbohydrates": number, "fiber": number, "sugar": number, "sodium": number, "vitamins": {{"vitamin_a": 0, "vitamin_c": 0, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0}}, "minerals": {{"iron": 0, "calcium": 0, "zinc": 0, "magnesium": 0}}}}
+
+JSON:"""
+
+async def analyze_nutrition_structured(input_text: str) -> tuple[dict, str, int]:
+    """
+        nutrition for one food via schema-constrained output, validated with StructuredNutrition
+        retries up to STRUCTURED_OUTPUT_RETRIES times with the validation errors added to the prompt,
+        then fails instead of inventing values
+        returns (nutrition, raw JSON, tokens saved by stopping the stream early)
+    """
+    base_prompt = build_nutrition_prompt(input_text)
+    prompt = base_prompt
+    problems = ""
+    tokens_saved = 0
+    for attempt in range(STRUCTURED_OUTPUT_RETRIES + 1):
+        content, saved = await get_ai_json_response(prompt, model=AI_BACKEND, json_schema=NUTRITION_JSON_SCHEMA)
+        tokens_saved += saved
+        try:
+            return StructuredNutrition.model_validate_json(content.strip()).model_dump(), content, tokens_saved
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'reply'}: {err['msg']}" for err in e.errors()[:3])
+            print(f"structured output attempt {attempt + 1} invalid: {problems}")
+            # tell the model what was wrong, otherwise the retry tends to repeat the same reply
+            prompt = (f"{base_prompt.removesuffix('JSON:')}Previous reply was invalid: {problems}. "
+                      "Return only the JSON object.\n\nJSON:")
+    raise HTTPException(
+        status_code=502,
+        detail=f"AI response did not match the nutrition schema after {STRUCTURED_OUTPUT_RETRIES + 1} attempts: {problems}"
+    )
+
+@app.post("/analyze_food", dependencies=[Depends(enforce_ai_rate_limit)])
 async def analyze_food(
     input: FoodInput,
     current_user: User = Depends(get_current_user),
@@ -288,114 +513,84 @@ async def analyze_food(
 ):
     # now current_user is the authenticated user object
     # you can use current_user.id as user_id
-    prompt = f"""
-Analyze the nutrition of the following food. Return ONLY a JSON object, no other text.
+    return await analyze_food_for_user(db, current_user.id, input.input_text)
 
-Food: {input.input_text}
-
-Return format (numbers only, no text):
-{{"calories": number, "protein": number, "fat": number, "carbohydrates": number, "fiber": number, "sugar": number, "sodium": number, "vitamins": {{"vitamin_a": 0, "vitamin_c": 0, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0}}, "minerals": {{"iron": 0, "calcium": 0, "zinc": 0, "magnesium": 0}}}}
-
-JSON:"""
+async def analyze_food_for_user(db: AsyncSession, user_id: int, input_text: str) -> dict:
+    """analyze one food description and record it as a meal, shared by /analyze_food and the job workers"""
+    prompt = build_nutrition_prompt(input_text)
     
+    cache_status = "miss"
+    source = "ai"
+    tokens_saved = 0
     try:
-        content = get_ai_response(prompt, model=AI_BACKEND)
-        
-        # debug: print the original content returned by AI
-        print(f"AI Response: {content}")
-        
-        # clean and extract JSON content
-        content = content.strip()
-        
-        # remove possible markdown code block markers
-        if content.startswith('```json'):
-            content = content[7:]
-        elif content.startswith('```'):
-            content = content[3:]
-        if content.endswith('```'):
-            content = content[:-3]
-        
-        # find JSON object
-        start = content.find('{')
-        end = content.rfind('}')
-        if start != -1 and end != -1:
-            content = content[start:end+1]
-        
-        # clean newlines and extra spaces
-        content = content.replace('\n', ' ').replace('\r', ' ')
-        content = re.sub(r'\s+', ' ', content)
-        
-        # fix common JSON format issues
-        # 1. replace smart quotes to standard double quotes
-        content = content.replace('"', '"').replace('"', '"')
-        content = content.replace(''', "'").replace(''', "'")
-        
-        # 2. remove possible non-printable characters
-        content = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', content)
+        cached = await nutrition_cache.get(db, input_text) if NUTRITION_CACHE_ENABLED else None
+        local = food_index.analyze(input_text) if cached is None and food_index is not None else None
+        if cached is not None:
+            # cache hit: skip the AI call and the JSON repair pipeline
+            cache_status = "hit"
+            source = "cache"
+            nutrition_data = cached
+            content = json.dumps(cached, ensure_ascii=False)
+        elif local is not None:
+            # common foods from the local composition table, the AI only handles the long tail
+            source = "local"
+            nutrition_data = local
+            content = json.dumps(local, ensure_ascii=False)
+        elif STRUCTURED_OUTPUT:
+            nutrition_data, content, tokens_saved = await analyze_nutrition_structured(input_text)
+            if NUTRITION_CACHE_ENABLED:
+                await nutrition_cache.put(db, input_text, nutrition_data)
+        else:
+            # streamed and cut off at the end of the JSON object, so no text after it reaches the repair step
+            content, tokens_saved = await get_ai_json_response(prompt, model=AI_BACKEND)
         
-        # 3. fix cases where there are quotes but the format is incorrect
-        content = re.sub(r'""(\w+)"":', r'"\1":', content)
+            # debug: print the original content returned by AI
+            print(f"AI Response: {content}")
         
-        # 3. check and fix incomplete JSON
-        if not content.endswith('}'):
-            # if JSON is incomplete, try to complete the missing parts
-            open_braces = content.count('{')
-            close_braces = content.count('}')
-            missing_braces = open_braces - close_braces
-            
-            # if minerals part is missing, add default values
-            if '"minerals"' not in content:
-                if content.endswith('"vitamins": { "vitamin_a": 0, "vitamin_c": 0, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0 }'):
-                    content += ', "minerals": { "iron": 0, "calcium": 0, "zinc": 0, "magnesium": 0 }'
-            
-            # complete missing braces
-            content += '}' * missing_braces
+            content = clean_ai_json(content)
         
-        print(f"Cleaned JSON: {content}")
+            print(f"Cleaned JSON: {content}")
         
-        # try to parse JSON, if failed, try to fallback to default values
-        try:
-            nutrition_data = json.loads(content)
-        except json.JSONDecodeError as json_error:
-            print(f"JSON parse failed: {json_error}")
-            print(f"Problematic content: {content}")
-            # if parsing fails, return default nutrition data
-            nutrition_data = {
-                "calories": 300,
-                "protein": 15,
-                "fat": 10,
-                "carbohydrates": 45,
-                "fiber": 3,
-                "sugar": 5,
-                "sodium": 200,
-                "vitamins": {
-                    "vitamin_a": 0,
-                    "vitamin_c": 0,
-                    "vitamin_d": 0,
-                    "vitamin_e": 0,
-                    "vitamin_b12": 0
-                },
-                "minerals": {
-                    "iron": 0,
-                    "calcium": 0,
-                    "zinc": 0,
-                    "magnesium": 0
+            # try to parse JSON, if failed, try to fallback to default values
+            try:
+                nutrition_data = json.loads(content)
+            except json.JSONDecodeError as json_error:
+                print(f"JSON parse failed: {json_error}")
+                print(f"Problematic content: {content}")
+                nutrition_fallbacks.labels().inc()
+                # if parsing fails, return default nutrition data
+                nutrition_data = {
+                    "calories": 300,
+                    "protein": 15,
+                    "fat": 10,
+                    "carbohydrates": 45,
+                    "fiber": 3,
+                    "sugar": 5,
+                    "sodium": 200,
+                    "vitamins": {
+                        "vitamin_a": 0,
+                        "vitamin_c": 0,
+                        "vitamin_d": 0,
+                        "vitamin_e": 0,
+                        "vitamin_b12": 0
+                    },
+                    "minerals": {
+                        "iron": 0,
+                        "calcium": 0,
+                        "zinc": 0,
+                        "magnesium": 0
+                    }
                 }
-            }
+            else:
+                if NUTRITION_CACHE_ENABLED:
+                    await nutrition_cache.put(db, input_text, nutrition_data)
         
         # save to database
         try:
-            # check if user exists
-            result = await db.execute(select(User).where(User.id == current_user.id))
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                raise HTTPException(status_code=404, detail="User not found")
-            
             # create meal record
             meal = Meal(
-                user_id=current_user.id,
-                input_text=input.input_text,
+                user_id=user_id,
+                input_text=input_text,
                 calories=nutrition_data.get('calories', 0),
                 protein=nutrition_data.get('protein', 0),
                 fat=nutrition_data.get('fat', 0),
@@ -408,75 +603,321 @@ JSON:"""
                 gpt_raw_response=content
             )
             db.add(meal)
-            await db.commit()
-            await db.refresh(meal)
-            print(f"data saved to database, record ID: {meal.id}")
             
-            # update or create daily summary
+            # update or create daily summary in the same transaction as the meal
             today = date.today()
-            await update_daily_summary(db, current_user.id, today, nutrition_data)
+            await update_daily_summary(db, user_id, today, nutrition_data, commit=False)
+            await db.commit()
+            print(f"data saved to database, record ID: {meal.id}")
             
         except Exception as db_error:
             print(f"database save failed: {db_error}")
             # even if database save fails, return nutrition analysis result
-            return nutrition_data
+            return {**nutrition_data, "cache": cache_status, "source": source, "tokens_saved": tokens_saved}
         
-        return nutrition_data
+        return {**nutrition_data, "cache": cache_status, "source": source, "tokens_saved": tokens_saved}
     except json.JSONDecodeError as e:
         print(f"JSON Parse Error: {e}")
         print(f"Raw content: {content}")
         raise HTTPException(status_code=500, detail=f"Failed to parse AI response as JSON. Raw response: {content[:200]}...")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def update_daily_summary(db: AsyncSession, user_id: int, date: date, nutrition_data: dict):
-    """update daily nutrition summary"""
-    # find today's summary record
-    result = await db.execute(
-        select(DailySummary).where(
-            DailySummary.user_id == user_id,
-            DailySummary.date == date
-        )
+async def process_food_job(job: Job) -> dict:
+    # each job gets its own session, the enqueuing request has long finished
+    async with AsyncSessionLocal() as db:
+        return await analyze_food_for_user(db, job.user_id, job.payload["input_text"])
+
+food_jobs = JobQueue(process_food_job)
+
+@app.post("/analyze_food/jobs", status_code=202, dependencies=[Depends(enforce_ai_rate_limit)])
+async def submit_analyze_food_job(
+    input: FoodInput,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """queue the analysis and return immediately, the result is fetched from GET /jobs/{job_id}"""
+    job = food_jobs.submit(current_user.id, {"input_text": input.input_text})
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=JOB_MAX_WAIT, description="seconds to long-poll for the result"),
+    current_user: User = Depends(get_current_user)
+):
+    job = food_jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await food_jobs.wait(job, wait)
+    return job.to_dict()
+
+async def update_daily_summary(db: AsyncSession, user_id: int, date: date, nutrition_data: dict, commit: bool = True):
+    """
+        add nutrition to the daily summary with a single INSERT ... ON CONFLICT DO UPDATE,
+        then to the weekly and monthly rollups the same way;
+        commit=False leaves the commit to the caller so it shares the meal's transaction
+    """
+    values = {
+        "total_calories": nutrition_data.get('calories', 0) or 0,
+        "total_protein": nutrition_data.get('protein', 0) or 0,
+        "total_fat": nutrition_data.get('fat', 0) or 0,
+        "total_carbs": nutrition_data.get('carbohydrates', 0) or 0,
+        "total_fiber": nutrition_data.get('fiber', 0) or 0,
+        "total_sugar": nutrition_data.get('sugar', 0) or 0,
+    }
+    now = datetime.utcnow()
+    stmt = dialect_insert(db, DailySummary).values(
+        user_id=user_id, date=date, created_at=now, **values
     )
-    daily_summary = result.scalar_one_or_none()
+    # increment in SQL so concurrent meals for the same day cannot lose an update
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailySummary.user_id, DailySummary.date],
+        set_={
+            col: func.coalesce(getattr(DailySummary, col), 0.0) + getattr(stmt.excluded, col)
+            for col in SUMMARY_TOTAL_COLUMNS
+        }
+    ).returning(DailySummary.created_at)
+    # created_at is only written on insert, so getting ours back means this meal started a new day
+    new_day = (await db.execute(stmt)).scalar_one() == now
+    await update_rollups(db, user_id, date, values, new_day, now)
     
-    if daily_summary:
-        # update existing record
-        daily_summary.total_calories += nutrition_data.get('calories', 0)
-        daily_summary.total_protein += nutrition_data.get('protein', 0)
-        daily_summary.total_fat += nutrition_data.get('fat', 0)
-        daily_summary.total_carbs += nutrition_data.get('carbohydrates', 0)
-        daily_summary.total_fiber += nutrition_data.get('fiber', 0)
-        daily_summary.total_sugar += nutrition_data.get('sugar', 0)
-    else:
-        # create new record
-        daily_summary = DailySummary(
-            user_id=user_id,
-            date=date,
-            total_calories=nutrition_data.get('calories', 0),
-            total_protein=nutrition_data.get('protein', 0),
-            total_fat=nutrition_data.get('fat', 0),
-            total_carbs=nutrition_data.get('carbohydrates', 0),
-            total_fiber=nutrition_data.get('fiber', 0),
-            total_sugar=nutrition_data.get('sugar', 0)
+    if commit:
+        await db.commit()
+
+async def update_rollups(db: AsyncSession, user_id: int, day: date, values: dict, new_day: bool, now: datetime):
+    """add the same totals to the week and month containing day"""
+    for period, model in ROLLUP_MODELS.items():
+        stmt = dialect_insert(db, model).values(
+            user_id=user_id, period_start=period_start(day, period),
+            days_logged=int(new_day), updated_at=now, **values
         )
-        db.add(daily_summary)
-    
-    await db.commit()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.user_id, model.period_start],
+            set_={
+                **{
+                    col: func.coalesce(getattr(model, col), 0.0) + getattr(stmt.excluded, col)
+                    for col in SUMMARY_TOTAL_COLUMNS
+                },
+                "days_logged": func.coalesce(model.days_logged, 0) + stmt.excluded.days_logged,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+        await db.execute(stmt)
+
+def build_batch_nutrition_prompt(input_texts: list[str]) -> str:
+    """prompt asking the AI for several foods' nutrition as one JSON array"""
+    foods = "\n".join(f"{i + 1}. {text}" for i, text in enumerate(input_texts))
+    return f"""
+Analyze the nutrition of each of the following foods. Return ONLY a JSON array with exactly {len(input_texts)} objects, one per food, in the same order. No other text.
+
+Foods:
+{foods}
+
+Each object format (numbers only, no text):
+{{"calories": number, "protein": number, "fat": number, "carbohydrates": number, "fiber": number, "sugar": number, "sodium": number, "vitamins": {{"vitamin_a": 0, "vitamin_c": 0, "vitamin_d": 0, "vitamin_e": 0, "vitamin_b12": 0}}, "minerals": {{"iron": 0, "calcium": 0, "zinc": 0, "magnesium": 0}}}}
+
+JSON:"""
+
+async def analyze_batch_fanout(input_texts: list[str]) -> list:
+    """one AI call per food, at most BATCH_ANALYZE_CONCURRENCY in flight"""
+    semaphore = asyncio.Semaphore(BATCH_ANALYZE_CONCURRENCY)
+
+    async def analyze_one(input_text: str):
+        async with semaphore:
+            if STRUCTURED_OUTPUT:
+                nutrition_data, _, _ = await analyze_nutrition_structured(input_text)
+                return nutrition_data
+            content = await get_ai_response(build_nutrition_prompt(input_text), model=AI_BACKEND)
+        nutrition_data = json.loads(clean_ai_json(content))
+        if not isinstance(nutrition_data, dict):
+            raise ValueError("AI response is not a JSON object")
+        return nutrition_data
+
+    return await asyncio.gather(*[analyze_one(text) for text in input_texts], return_exceptions=True)
+
+async def analyze_batch_packed(input_texts: list[str]) -> list:
+    """all foods in a single AI call returning a JSON array"""
+    try:
+        content = await get_ai_response(build_batch_nutrition_prompt(input_texts), model=AI_BACKEND)
+        start = content.find('[')
+        end = content.rfind(']')
+        if start == -1 or end == -1:
+            raise ValueError("AI response contains no JSON array")
+        items = json.loads(content[start:end+1])
+    except Exception as e:
+        return [e] * len(input_texts)
+    if not isinstance(items, list):
+        return [ValueError("AI response is not a JSON array")] * len(input_texts)
+    results = []
+    for i in range(len(input_texts)):
+        if i >= len(items):
+            results.append(ValueError("AI response has no result for this item"))
+            continue
+        # same schema as the fan-out path, so a malformed item fails alone instead of being saved
+        try:
+            results.append(StructuredNutrition.model_validate(items[i]).model_dump())
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors()[:3])
+            results.append(ValueError(f"AI result does not match the nutrition schema: {problems}"))
+    return results
+
+@app.post("/analyze_food/batch")
+async def analyze_food_batch(
+    batch: BatchFoodInput,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """analyze several food descriptions and save them in one transaction"""
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No items to analyze")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items, maximum is {BATCH_MAX_ITEMS}")
+
+    # cache lookups share the session, so they run sequentially before the fan-out
+    analyzed: list = [None] * len(batch.items)
+    cache_status = ["miss"] * len(batch.items)
+    sources = ["ai"] * len(batch.items)
+    for i, item in enumerate(batch.items):
+        cached = await nutrition_cache.get(db, item.input_text) if NUTRITION_CACHE_ENABLED else None
+        if cached is not None:
+            analyzed[i] = cached
+            cache_status[i] = "hit"
+            sources[i] = "cache"
+        elif food_index is not None:
+            analyzed[i] = food_index.analyze(item.input_text)
+            if analyzed[i] is not None:
+                sources[i] = "local"
+
+    pending = [i for i in range(len(batch.items)) if analyzed[i] is None]
+    if len(pending) > BATCH_MAX_AI_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{len(pending)} foods need AI analysis, maximum is {BATCH_MAX_AI_ITEMS} per batch "
+                   f"(cached and common foods do not count, up to {BATCH_MAX_ITEMS} items in total)"
+        )
+    # one rate-limit token per food that still needs the AI, not one per batch
+    if RATE_LIMIT_ENABLED:
+        user_rate_limiter.check(current_user.id, cost=max(1, len(pending)))
+    if pending:
+        texts = [batch.items[i].input_text for i in pending]
+        if BATCH_ANALYZE_MODE == "packed":
+            outcomes = await analyze_batch_packed(texts)
+        else:
+            outcomes = await analyze_batch_fanout(texts)
+        for i, outcome in zip(pending, outcomes):
+            analyzed[i] = outcome
+            if NUTRITION_CACHE_ENABLED and isinstance(outcome, dict):
+                await nutrition_cache.put(db, batch.items[i].input_text, outcome)
+
+    # insert all meals and one summary delta per day in a single transaction
+    results = []
+    meals = []
+    deltas: dict[date, dict] = {}
+    for i, item in enumerate(batch.items):
+        outcome = analyzed[i]
+        if isinstance(outcome, Exception):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            results.append({"index": i, "input_text": item.input_text, "status": "error", "error": detail})
+            continue
+        meal = Meal(
+            user_id=current_user.id,
+            input_text=item.input_text,
+            calories=outcome.get('calories', 0),
+            protein=outcome.get('protein', 0),
+            fat=outcome.get('fat', 0),
+            carbohydrates=outcome.get('carbohydrates', 0),
+            fiber=outcome.get('fiber', 0),
+            sugar=outcome.get('sugar', 0),
+            sodium=outcome.get('sodium', 0),
+            vitamins=json.dumps(outcome.get('vitamins', {}), ensure_ascii=False),
+            minerals=json.dumps(outcome.get('minerals', {}), ensure_ascii=False),
+            gpt_raw_response=json.dumps(outcome, ensure_ascii=False)
+        )
+        if item.meal_time is not None:
+            meal.meal_time = item.meal_time
+        meals.append(meal)
+        day = item.meal_time.date() if item.meal_time is not None else date.today()
+        delta = deltas.setdefault(day, {})
+        for key in ('calories', 'protein', 'fat', 'carbohydrates', 'fiber', 'sugar'):
+            delta[key] = delta.get(key, 0) + (outcome.get(key, 0) or 0)
+        results.append({"index": i, "input_text": item.input_text, "status": "ok",
+                        "cache": cache_status[i], "source": sources[i], "nutrition": outcome})
+
+    try:
+        db.add_all(meals)
+        for day, delta in deltas.items():
+            await update_daily_summary(db, current_user.id, day, delta, commit=False)
+        await db.commit()
+    except Exception as db_error:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"database save failed: {db_error}")
+
+    meal_ids = iter(meal.id for meal in meals)
+    for result in results:
+        if result["status"] == "ok":
+            result["meal_id"] = next(meal_ids)
+    return {
+        "mode": BATCH_ANALYZE_MODE,
+        "saved": len(meals),
+        "failed": len(results) - len(meals),
+        "results": results
+    }
 
 # get user meal records
+def encode_meal_cursor(meal: Meal) -> str:
+    """opaque keyset cursor for the (meal_time, id) position of a meal"""
+    raw = f"{meal.meal_time.isoformat()}|{meal.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_meal_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        meal_time, meal_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(meal_time), int(meal_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/meals")
 async def get_user_meals(
+    limit: Optional[int] = Query(None, ge=1, le=MEALS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """
+        meals of the current user, newest first
+        limit/cursor page through results by (meal_time, id); from/to are inclusive dates
+        without limit every matching meal is returned
+    """
     user_id = current_user.id
     # only return records of the current logged-in user
+    query = select(Meal).where(Meal.user_id == user_id)
+    if from_date:
+        query = query.where(Meal.meal_time >= datetime.combine(from_date, datetime.min.time()))
+    if to_date:
+        query = query.where(Meal.meal_time < datetime.combine(to_date + timedelta(days=1), datetime.min.time()))
+    if cursor:
+        cursor_time, cursor_id = decode_meal_cursor(cursor)
+        query = query.where(or_(
+            Meal.meal_time < cursor_time,
+            and_(Meal.meal_time == cursor_time, Meal.id < cursor_id)
+        ))
+    query = query.order_by(Meal.meal_time.desc(), Meal.id.desc())
+    if limit:
+        # fetch one extra row to know whether another page exists
+        query = query.limit(limit + 1)
     try:
-        result = await db.execute(
-            select(Meal).where(Meal.user_id == user_id).order_by(Meal.meal_time.desc())
-        )
+        result = await db.execute(query)
         meals = result.scalars().all()
+        next_cursor = None
+        if limit and len(meals) > limit:
+            meals = meals[:limit]
+            next_cursor = encode_meal_cursor(meals[-1])
         return {
             "user_id": user_id, 
             "meals": [
@@ -494,7 +935,8 @@ async def get_user_meals(
                     "minerals": json.loads(str(meal.minerals)) if meal.minerals is not None else {},
                     "meal_time": meal.meal_time
                 } for meal in meals
-            ]
+            ],
+            "next_cursor": next_cursor
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -548,6 +990,258 @@ async def get_daily_summary(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def empty_totals() -> dict:
+    return {col: 0.0 for col in SUMMARY_TOTAL_COLUMNS}
+
+# get daily summaries for a date range (calendar view)
+@app.get("/daily_summary/range")
+async def get_daily_summary_range(
+    start_date: date,
+    end_date: date,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+        every day between start_date and end_date (inclusive) in one query,
+        days without data are zero-filled; weekly (monday start) and monthly totals included
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end_date - start_date).days >= SUMMARY_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range too long, maximum is {SUMMARY_RANGE_MAX_DAYS} days")
+    try:
+        result = await db.execute(
+            select(DailySummary).where(
+                DailySummary.user_id == current_user.id,
+                DailySummary.date >= start_date,
+                DailySummary.date <= end_date
+            ).order_by(DailySummary.date)
+        )
+        rows = {row.date: row for row in result.scalars().all()}
+
+        days = []
+        weeks: dict[date, dict] = {}
+        months: dict[str, dict] = {}
+        totals = empty_totals()
+        day = start_date
+        while day <= end_date:
+            row = rows.get(day)
+            values = {col: (getattr(row, col) or 0.0) if row else 0.0 for col in SUMMARY_TOTAL_COLUMNS}
+            days.append({"date": day.isoformat(), "has_data": row is not None, **values})
+            week = weeks.setdefault(day - timedelta(days=day.weekday()), empty_totals())
+            month = months.setdefault(day.strftime("%Y-%m"), empty_totals())
+            for col, value in values.items():
+                week[col] += value
+                month[col] += value
+                totals[col] += value
+            day += timedelta(days=1)
+
+        def rounded(values: dict) -> dict:
+            return {col: round(value, 2) for col, value in values.items()}
+
+        return {
+            "user_id": current_user.id,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "days": days,
+            "weeks": [{"week_start": week_start.isoformat(), **rounded(values)} for week_start, values in weeks.items()],
+            "months": [{"month": month, **rounded(values)} for month, values in months.items()],
+            "totals": rounded(totals)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+EXPORT_MEAL_COLUMNS = [
+    "id", "meal_time", "input_text", "calories", "protein", "fat", "carbohydrates",
+    "fiber", "sugar", "sodium", "vitamins", "minerals"
+]
+EXPORT_SUMMARY_COLUMNS = ["date", *SUMMARY_TOTAL_COLUMNS]
+
+def export_row(row, columns: list[str], fmt: str) -> dict:
+    values = {col: getattr(row, col) for col in columns}
+    for col in ("meal_time", "date"):
+        if values.get(col) is not None:
+            values[col] = values[col].isoformat()
+    if fmt == "ndjson":
+        for col in ("vitamins", "minerals"):
+            if col in values:
+                values[col] = json.loads(values[col]) if values[col] else {}
+    return values
+
+async def export_chunks(user_id: int, dataset: str, fmt: str,
+                        from_date: Optional[date], to_date: Optional[date]) -> AsyncIterator[str]:
+    """
+        one text chunk per EXPORT_CHUNK_SIZE rows, read through a streaming cursor,
+        uses its own session because the request's session is closed once the response starts
+    """
+    queries = []
+    if dataset in ("all", "meals"):
+        query = select(*[getattr(Meal, col) for col in EXPORT_MEAL_COLUMNS]).where(Meal.user_id == user_id)
+        if from_date:
+            query = query.where(Meal.meal_time >= datetime.combine(from_date, datetime.min.time()))
+        if to_date:
+            query = query.where(Meal.meal_time < datetime.combine(to_date + timedelta(days=1), datetime.min.time()))
+        queries.append(("meal", EXPORT_MEAL_COLUMNS, query.order_by(Meal.meal_time, Meal.id)))
+    if dataset in ("all", "daily_summary"):
+        query = select(*[getattr(DailySummary, col) for col in EXPORT_SUMMARY_COLUMNS]).where(DailySummary.user_id == user_id)
+        if from_date:
+            query = query.where(DailySummary.date >= from_date)
+        if to_date:
+            query = query.where(DailySummary.date <= to_date)
+        queries.append(("daily_summary", EXPORT_SUMMARY_COLUMNS, query.order_by(DailySummary.date)))
+
+    async with AsyncSessionLocal() as db:
+        for kind, columns, query in queries:
+            result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            buffer = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+            async for rows in result.partitions():
+                for row in rows:
+                    values = export_row(row, columns, fmt)
+                    if fmt == "csv":
+                        writer.writerow(values.values())
+                    else:
+                        buffer.write(json.dumps({"type": kind, **values}, ensure_ascii=False))
+                        buffer.write("\n")
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+
+async def encode_chunks(chunks: AsyncIterator[str], compress: bool) -> AsyncIterator[bytes]:
+    """utf-8 bytes, optionally gzip-compressed incrementally"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip container
+    async for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+# export the current user's history
+@app.get("/export")
+async def export_history(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    dataset: str = Query("all", pattern="^(all|meals|daily_summary)$"),
+    gzip: bool = False,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+        stream meals and daily summaries as NDJSON (one object per line, "type" tells them apart)
+        or CSV (one dataset per file); memory stays flat regardless of history size
+    """
+    if format == "csv" and dataset == "all":
+        raise HTTPException(status_code=400, detail="CSV export needs dataset=meals or dataset=daily_summary")
+    filename = f"nutricoach-{dataset}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        encode_chunks(export_chunks(current_user.id, dataset, format, from_date, to_date), gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def estimate_calorie_target(profile) -> float:
+    """daily kcal target: Mifflin-St Jeor BMR x 1.4 activity, -500 to lose / +300 to gain weight"""
+    if not profile or not (profile.weight and profile.height and profile.age):
+        return TRENDS_DEFAULT_CALORIE_TARGET
+    offset = {"male": 5, "female": -161}.get(profile.gender, -78)
+    target = (10 * profile.weight + 6.25 * profile.height - 5 * profile.age + offset) * 1.4
+    if profile.target_weight and profile.target_weight < profile.weight:
+        target -= 500
+    elif profile.target_weight and profile.target_weight > profile.weight:
+        target += 300
+    return float(round(max(1200, target)))
+
+def periods_before(start: date, period: str, count: int) -> date:
+    """start of the period count periods before start"""
+    if period == "week":
+        return start - timedelta(weeks=count)
+    months = start.year * 12 + start.month - 1 - count
+    return date(months // 12, months % 12 + 1, 1)
+
+# nutrition trends (weekly or monthly)
+@app.get("/trends")
+async def get_trends(
+    period: str = Query("week", pattern="^(week|month)$"),
+    periods: int = Query(12, ge=1, le=120),
+    window: int = Query(4, ge=1, le=24),
+    calorie_target: Optional[float] = Query(None, gt=0),
+    context: UserContext = Depends(get_current_user_context),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+        the last `periods` weeks/months from the rollup tables, one row per logged period:
+        per-day averages, rolling averages over the last `window` periods, macro energy ratios
+        and calorie adherence; everything is computed in SQL
+    """
+    model = ROLLUP_MODELS[period]
+    target = calorie_target or estimate_calorie_target(context.profile)
+    since = periods_before(period_start(date.today(), period), period, periods - 1)
+    # earlier periods feed the rolling window of the first returned ones
+    history_start = periods_before(since, period, window - 1)
+
+    # RANGE over the period number, so weeks/months without meals still use up the window
+    rolling = {"order_by": period_index(db, model.period_start, period), "range_": (-(window - 1), 0)}
+    days = func.nullif(model.days_logged, 0)
+    rolling_days = func.nullif(func.sum(model.days_logged).over(**rolling), 0)
+    energy = func.nullif(model.total_protein * 4 + model.total_fat * 9 + model.total_carbs * 4, 0)
+    rows = select(
+        model.period_start, model.days_logged, *[getattr(model, col) for col in SUMMARY_TOTAL_COLUMNS],
+        (model.total_calories / days).label("avg_calories"),
+        (model.total_protein / days).label("avg_protein"),
+        (func.sum(model.total_calories).over(**rolling) / rolling_days).label("rolling_avg_calories"),
+        (func.sum(model.total_protein).over(**rolling) / rolling_days).label("rolling_avg_protein"),
+        (model.total_protein * 4 / energy).label("protein_ratio"),
+        (model.total_fat * 9 / energy).label("fat_ratio"),
+        (model.total_carbs * 4 / energy).label("carbs_ratio"),
+    ).where(model.user_id == context.user.id, model.period_start >= history_start).subquery()
+    trend = select(
+        rows,
+        (rows.c.avg_calories / target).label("calorie_adherence"),
+        case((func.abs(rows.c.avg_calories - target) <= target * TRENDS_TARGET_TOLERANCE, 1), else_=0).label("on_target"),
+    ).where(rows.c.period_start >= since).subquery()
+    overall_energy = func.nullif(func.sum(trend.c.total_protein * 4 + trend.c.total_fat * 9 + trend.c.total_carbs * 4), 0)
+    overall = select(
+        func.count().label("periods_logged"),
+        func.coalesce(func.sum(trend.c.days_logged), 0).label("days_logged"),
+        (func.sum(trend.c.total_calories) / func.nullif(func.sum(trend.c.days_logged), 0)).label("avg_calories"),
+        (func.sum(trend.c.total_calories) / func.nullif(func.sum(trend.c.days_logged), 0) / target).label("calorie_adherence"),
+        func.coalesce(func.sum(trend.c.on_target), 0).label("periods_on_target"),
+        (func.sum(trend.c.total_protein) * 4 / overall_energy).label("protein_ratio"),
+        (func.sum(trend.c.total_fat) * 9 / overall_energy).label("fat_ratio"),
+        (func.sum(trend.c.total_carbs) * 4 / overall_energy).label("carbs_ratio"),
+    )
+    try:
+        result = await db.execute(select(trend).order_by(trend.c.period_start))
+        trend_rows = result.mappings().all()
+        totals = (await db.execute(overall)).mappings().one()
+
+        def rounded(values) -> dict:
+            return {
+                key: value.isoformat() if isinstance(value, date) else round(value, 3) if isinstance(value, float) else value
+                for key, value in values.items()
+            }
+
+        return {
+            "user_id": context.user.id,
+            "period": period,
+            "since": since.isoformat(),
+            "window": window,
+            "calorie_target": target,
+            "target_tolerance": TRENDS_TARGET_TOLERANCE,
+            "periods": [rounded(row) for row in trend_rows],
+            "overall": rounded(totals)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # get current user info
 @app.get("/users/me")
 async def get_user_me(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -567,9 +1261,8 @@ async def get_user_me(db: AsyncSession = Depends(get_db), current_user: User = D
 
 # get current user profile
 @app.get("/profile")
-async def get_profile(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(UserProfile).where(UserProfile.user_id == current_user.id))
-    profile = result.scalar_one_or_none()
+async def get_profile(context: UserContext = Depends(get_current_user_context)):
+    profile = context.profile
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     return {
@@ -604,6 +1297,7 @@ async def update_profile(
         db.add(profile)
     await db.commit()
     await db.refresh(profile)
+    user_context_cache.invalidate(current_user.id)
     return {
         "id": profile.id,
         "user_id": profile.user_id,
@@ -618,17 +1312,8 @@ async def update_profile(
         "updated_at": profile.updated_at
     }
 
-@app.post("/generate_advice")
-async def generate_advice(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
-    summary: dict = Body(...)
-):
-    # get user profile
-    result = await db.execute(select(UserProfile).where(UserProfile.user_id == current_user.id))
-    profile = result.scalar_one_or_none()
-    if not profile:
-        raise HTTPException(status_code=404, detail="Profile not found")
+def build_advice_prompt(profile, summary: dict) -> str:
+    """prompt for daily advice from the user profile and today's nutrition summary"""
     # calculate user's goal type
     current_weight = profile.weight or 0
     target_weight = profile.target_weight or 0
@@ -676,32 +1361,10 @@ Provide advice specifically for someone who wants to {weight_goal.lower()}. Focu
 
 Respond now.
 """
+    return prompt
 
-    try:
-        raw_advice = get_ai_response(prompt, model=AI_BACKEND)
-        return {"advice": raw_advice}
-    except Exception as e:
-        print(f"Error generating advice: {e}")
-        return {"advice": "• Increase vegetable and fruit intake\n• Control portion size of high-calorie foods\n• Keep it simple and easy to follow."}
-
-@app.post("/generate_meal_advice")
-async def generate_meal_advice(
-    data: dict = Body(...),
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """
-    Generate AI advice for a single meal.
-    Input: user's meal description and AI-analyzed nutrition.
-    Output: concise, personalized advice based on the user's profile and this meal's nutrition.
-    """
-    input_text = data.get("input_text", "")
-    nutrition = data.get("nutrition", {})
-    
-    # Fetch user profile
-    result = await db.execute(select(UserProfile).where(UserProfile.user_id == current_user.id))
-    profile = result.scalar_one_or_none()
-    
+def build_meal_advice_prompt(profile, input_text: str, nutrition) -> str:
+    """prompt for advice on a single meal; profile may be None"""
     # calculate user's goal type
     weight_goal = "maintain weight"
     if profile:
@@ -755,22 +1418,132 @@ Provide advice specifically for someone who wants to {weight_goal.lower()}.
 
 Respond now.
 """
+    return prompt
 
-    raw_advice = get_ai_response(prompt, model=AI_BACKEND)
+@app.post("/generate_advice", dependencies=[Depends(enforce_ai_rate_limit)])
+async def generate_advice(
+    context: UserContext = Depends(get_current_user_context),
+    summary: dict = Body(...)
+):
+    # get user profile
+    profile = context.profile
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    prompt = build_advice_prompt(profile, summary)
+
+    try:
+        if ADVICE_BOUNDED:
+            return {"advice": await get_bounded_advice(prompt)}
+        raw_advice = await get_ai_response(prompt, model=AI_BACKEND)
+        return {"advice": raw_advice}
+    except AdmissionRejected:
+        # overload must reach the client as 503 + Retry-After, not as canned advice
+        raise
+    except Exception as e:
+        print(f"Error generating advice: {e}")
+        return {"advice": "• Increase vegetable and fruit intake\n• Control portion size of high-calorie foods\n• Keep it simple and easy to follow."}
+
+@app.post("/generate_meal_advice", dependencies=[Depends(enforce_ai_rate_limit)])
+async def generate_meal_advice(
+    data: dict = Body(...),
+    context: UserContext = Depends(get_current_user_context)
+):
+    """
+    Generate AI advice for a single meal.
+    Input: user's meal description and AI-analyzed nutrition.
+    Output: concise, personalized advice based on the user's profile and this meal's nutrition.
+    """
+    input_text = data.get("input_text", "")
+    nutrition = data.get("nutrition", {})
+    
+    # Fetch user profile
+    profile = context.profile
+    
+    prompt = build_meal_advice_prompt(profile, input_text, nutrition)
+
+    if ADVICE_BOUNDED:
+        return {"advice": await get_bounded_advice(prompt)}
+    raw_advice = await get_ai_response(prompt, model=AI_BACKEND)
     return {"advice": raw_advice}
 
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """format one server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return prefix + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_advice_events(tokens: AsyncIterator[str], first: Optional[str]):
+    """
+        forward model tokens as SSE 'data' events, then a final 'done' event with the full advice
+        in bounded mode the stream ends at the advice budget and 'done' carries the formatted points
+    """
+    chunks = []
+    try:
+        if first is not None:
+            chunks.append(first)
+            yield sse_event({"token": first})
+        async for token in tokens:
+            chunks.append(token)
+            yield sse_event({"token": token})
+    except HTTPException as e:
+        yield sse_event({"detail": e.detail}, event="error")
+        return
+    finally:
+        await tokens.aclose()
+    advice = "".join(chunks)
+    if ADVICE_BOUNDED:
+        advice = format_advice_points(advice, max_words=ADVICE_MAX_WORDS)
+    yield sse_event({"advice": advice}, event="done")
+
+async def advice_stream_response(prompt: str) -> StreamingResponse:
+    tokens = generate_bounded_advice(prompt) if ADVICE_BOUNDED else stream_ai_response(prompt, model=AI_BACKEND)
+    # wait for the first token before answering, so admission rejections and backend errors
+    # get a real status code (503 + Retry-After) instead of a 200 event stream with an error event
+    try:
+        first = await tokens.__anext__()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(
+        stream_advice_events(tokens, first),
+        media_type="text/event-stream",
+        # disable proxy buffering so tokens reach the client immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/generate_advice/stream", dependencies=[Depends(enforce_ai_rate_limit)])
+async def generate_advice_stream(
+    context: UserContext = Depends(get_current_user_context),
+    summary: dict = Body(...)
+):
+    """streaming variant of /generate_advice, tokens are sent as server-sent events"""
+    profile = context.profile
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return await advice_stream_response(build_advice_prompt(profile, summary))
+
+@app.post("/generate_meal_advice/stream", dependencies=[Depends(enforce_ai_rate_limit)])
+async def generate_meal_advice_stream(
+    data: dict = Body(...),
+    context: UserContext = Depends(get_current_user_context)
+):
+    """streaming variant of /generate_meal_advice, tokens are sent as server-sent events"""
+    profile = context.profile
+    prompt = build_meal_advice_prompt(profile, data.get("input_text", ""), data.get("nutrition", {}))
+    return await advice_stream_response(prompt)
+
 @app.post("/change_password")
 async def change_password(
     req: ChangePasswordRequest,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    # current_user may be a cached detached object, update a row loaded in this session instead
+    user = await db.get(User, current_user.id)
     # check old password
-    if not verify_password(req.old_password, current_user.password_hash):
+    if not user or not verify_password(req.old_password, user.password_hash):
         raise HTTPException(status_code=400, detail="Old password is incorrect")
     # update new password
-    current_user.password_hash = hash_password(req.new_password)
-    db.add(current_user)
+    user.password_hash = hash_password(req.new_password)
     await db.commit()
+    user_context_cache.invalidate(current_user.id)
     return {"message": "Password changed successfully"}
 
@@ -0,0 +1,223 @@
+#进程内指标：固定桶直方图 + 计数器，/metrics 输出Prometheus文本格式
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """fixed-bucket histogram; observe() only touches preallocated slots"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """upper bound of the bucket holding the q-th observation (None if empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class MetricFamily:
+    """one metric name with a child per label-value combination"""
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind  # "histogram", "counter" or "gauge"
+        self.label_names = label_names
+        self.buckets = buckets
+        self.children: dict[tuple, object] = {}
+
+    def labels(self, *values):
+        """child for these label values, created once and reused afterwards"""
+        child = self.children.get(values)
+        if child is None:
+            if self.kind == "histogram":
+                child = Histogram(self.buckets)
+            elif self.kind == "gauge":
+                child = Gauge()
+            else:
+                child = Counter()
+            self.children[values] = child
+        return child
+
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.children.items():
+            if isinstance(child, Histogram):
+                cumulative = 0
+                for bound, n in zip(child.buckets, child.counts):
+                    cumulative += n
+                    le = self._label_text(values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = self._label_text(values, 'le="+Inf"')
+                labels = self._label_text(values)
+                lines.append(f"{self.name}_bucket{le} {child.count}")
+                lines.append(f"{self.name}_sum{labels} {child.sum}")
+                lines.append(f"{self.name}_count{labels} {child.count}")
+            else:
+                lines.append(f"{self.name}{self._label_text(values)} {child.value}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families: dict[str, MetricFamily] = {}
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        self.families[family.name] = family
+        return family
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(name, help_text, "histogram", label_names, buckets))
+
+    def counter(self, name, help_text, label_names=()) -> MetricFamily:
+        return self._register(MetricFamily(name, help_text, "counter", label_names))
+
+    def gauge(self, name, help_text, label_names=()) -> MetricFamily:
+        return self._register(MetricFamily(name, help_text, "gauge", label_names))
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "latency of individual SQL statements")
+db_queries_per_request = registry.histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", buckets=COUNT_BUCKETS)
+db_time_per_request = registry.histogram(
+    "db_time_per_request_seconds", "total SQL time per HTTP request")
+llm_request_duration = registry.histogram(
+    "llm_request_duration_seconds", "AI backend call latency", ("backend", "model"))
+llm_errors = registry.counter(
+    "llm_errors_total", "failed AI backend calls", ("backend", "model"))
+llm_tokens_saved = registry.counter(
+    "llm_tokens_saved_total", "generation budget left unused by cutting off JSON streams the model was still writing (upper bound)", ("backend", "model"))
+admission_queue_depth = registry.gauge(
+    "ai_admission_queue_depth", "callers waiting for an AI backend slot", ("backend",))
+admission_in_flight = registry.gauge(
+    "ai_admission_in_flight", "AI calls holding a backend slot", ("backend",))
+admission_rejections = registry.counter(
+    "ai_admission_rejections_total", "AI requests rejected by admission control", ("backend", "reason"))
+hedge_requests = registry.counter(
+    "ai_hedge_requests_total", "hedged AI calls: fired, and whether the duplicate won or lost", ("backend", "outcome"))
+json_repair_attempts = registry.counter(
+    "json_repair_attempts_total", "AI replies run through the JSON repair pipeline")
+nutrition_fallbacks = registry.counter(
+    "nutrition_fallback_total", "analyze_food replies replaced by the default nutrition dict")
+
+# per-request DB accounting: [query count, seconds], set by the HTTP middleware
+_request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+
+def instrument_engine(sync_engine):
+    """time every SQL statement on this engine and attribute it to the current request"""
+    from sqlalchemy import event
+
+    query_histogram = db_query_duration.labels()
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        query_histogram.observe(elapsed)
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+class MetricsMiddleware:
+    """pure ASGI middleware recording latency per matched route and DB usage per request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_histograms: dict = {}  # (id(route), method) -> Histogram; routes live as long as the app
+        self._unmatched = http_request_duration.labels("ANY", "unmatched")
+        self._db_queries = db_queries_per_request.labels()
+        self._db_time = db_time_per_request.labels()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = [0, 0.0]
+        token = _request_db_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db_stats.reset(token)
+            route = scope.get("route")
+            if route is None:
+                histogram = self._unmatched
+            else:
+                key = (id(route), scope["method"])
+                histogram = self._route_histograms.get(key)
+                if histogram is None:
+                    histogram = http_request_duration.labels(scope["method"], route.path)
+                    self._route_histograms[key] = histogram
+            histogram.observe(elapsed)
+            self._db_queries.observe(stats[0])
+            self._db_time.observe(stats[1])
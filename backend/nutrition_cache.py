@@ -0,0 +1,159 @@
+#营养分析结果缓存：进程内LRU + 数据库持久化
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+
+from db.db import NutritionCache, dialect_insert
+
+NUTRITION_CACHE_ENABLED = os.getenv("NUTRITION_CACHE_ENABLED", "true").lower() == "true"
+NUTRITION_CACHE_SIZE = int(os.getenv("NUTRITION_CACHE_SIZE", "2048"))
+NUTRITION_CACHE_TTL = int(os.getenv("NUTRITION_CACHE_TTL", str(60 * 60)))  # in-process tier, seconds
+NUTRITION_CACHE_DB_TTL = int(os.getenv("NUTRITION_CACHE_DB_TTL", str(30 * 24 * 60 * 60)))  # persistent tier, seconds
+
+# session.info key for entries written in the open transaction, published to memory on commit
+_PENDING_KEY = "nutrition_cache_pending"
+
+# words that describe when/how a food was eaten, not what it was
+FILLER_PHRASES_EN = [
+    "for breakfast", "for lunch", "for dinner", "for supper", "for a snack", "as a snack", "for snack",
+    "this morning", "this afternoon", "this evening", "last night", "tonight", "today", "yesterday",
+    "and went out", "i just", "i had", "i ate", "just", "had", "ate", "eaten", "have", "i", "the", "an", "a",
+]
+FILLER_PHRASES_ZH = [
+    "今天", "昨天", "今早", "早上", "上午", "中午", "下午", "傍晚", "晚上", "夜宵",
+    "早餐", "早饭", "午餐", "午饭", "晚餐", "晚饭", "我吃了", "我喝了", "吃了", "喝了", "我",
+]
+
+_EN_FILLER_RE = re.compile(r"\b(?:" + "|".join(re.escape(p) for p in FILLER_PHRASES_EN) + r")\b")
+_ZH_FILLER_RE = re.compile("|".join(re.escape(p) for p in FILLER_PHRASES_ZH))
+
+
+def strip_filler(text: str) -> str:
+    """remove time/meal filler phrases from lowercased text"""
+    text = _EN_FILLER_RE.sub(" ", text)
+    return _ZH_FILLER_RE.sub(" ", text)
+
+
+def normalize_food_text(text: str) -> str:
+    """normalize a food description so equivalent inputs share one cache key"""
+    # full-width -> half-width, compatibility forms folded
+    text = unicodedata.normalize("NFKC", text).lower()
+    # punctuation and symbols become spaces
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+    text = strip_filler(text)
+    return " ".join(text.split())
+
+
+def text_hash(key: str) -> str:
+    """fixed-width unique key for a normalized description of any length"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class NutritionResultCache:
+    """two-tier cache: in-process LRU with TTL in front of the nutrition_cache table"""
+
+    def __init__(self, max_size: int = NUTRITION_CACHE_SIZE, ttl: int = NUTRITION_CACHE_TTL,
+                 db_ttl: int = NUTRITION_CACHE_DB_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_ttl = db_ttl
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def _put_memory(self, key: str, data: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, db: AsyncSession, input_text: str) -> Optional[dict]:
+        """look up cached nutrition data, memory first then database"""
+        key = normalize_food_text(input_text)
+        if not key:
+            return None
+        data = self._get_memory(key)
+        if data is not None:
+            self.memory_hits += 1
+            return dict(data)
+        result = await db.execute(select(NutritionCache).where(NutritionCache.text_hash == text_hash(key)))
+        row = result.scalar_one_or_none()
+        if row is not None:
+            age = datetime.datetime.utcnow() - (row.updated_at or row.created_at)
+            if age.total_seconds() <= self.db_ttl:
+                data = json.loads(row.nutrition)
+                self._put_memory(key, data)
+                self.db_hits += 1
+                return dict(data)
+        self.misses += 1
+        return None
+
+    async def put(self, db: AsyncSession, input_text: str, nutrition_data: dict):
+        """store nutrition data in both tiers; the caller commits the session, memory is filled only after that"""
+        key = normalize_food_text(input_text)
+        if not key:
+            return
+        now = datetime.datetime.utcnow()
+        payload = json.dumps(nutrition_data, ensure_ascii=False)
+        stmt = dialect_insert(db, NutritionCache).values(
+            text_hash=text_hash(key), normalized_text=key, nutrition=payload, created_at=now, updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[NutritionCache.text_hash],
+            set_={"nutrition": stmt.excluded.nutrition, "updated_at": stmt.excluded.updated_at},
+        )
+        await db.execute(stmt)
+        db.info.setdefault(_PENDING_KEY, []).append((self, key, dict(nutrition_data)))
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "enabled": NUTRITION_CACHE_ENABLED,
+            "size": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+        }
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_entries(session):
+    for cache, key, data in session.info.pop(_PENDING_KEY, []):
+        cache._put_memory(key, data)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_rolled_back_entries(session, previous_transaction):
+    # a rolled-back result must not be served from memory for the next NUTRITION_CACHE_TTL seconds
+    session.info.pop(_PENDING_KEY, None)
+
+
+nutrition_cache = NutritionResultCache()
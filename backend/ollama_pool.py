@@ -0,0 +1,170 @@
+#多个Ollama实例：最少在途请求路由 + 健康检查 + 熔断，失败时换节点重试
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+from fastapi import HTTPException
+
+OLLAMA_MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "2"))  # instances tried per call
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))  # consecutive failures that open the circuit
+OLLAMA_CIRCUIT_COOLDOWN = float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN", "30"))  # seconds an open circuit skips the instance
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))  # seconds between probes, 0 disables
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+
+
+def is_retriable(error: Exception) -> bool:
+    """connection problems and 5xx replies are worth another instance, 4xx are not"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class OllamaEndpoint:
+    """one Ollama instance with its load and failure state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True  # last health probe result
+        self.open_until = 0.0  # circuit open (instance skipped) until this monotonic time
+
+    def circuit_open(self, now: float) -> bool:
+        return self.open_until > now
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= OLLAMA_FAILURE_THRESHOLD:
+            # also re-opens right away when a trial call after the cooldown fails
+            self.open_until = time.monotonic() + OLLAMA_CIRCUIT_COOLDOWN
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "healthy": self.healthy,
+            "circuit_open": self.circuit_open(time.monotonic()),
+        }
+
+
+class OllamaPool:
+    """routes each call to the available instance with the fewest outstanding requests"""
+
+    def __init__(self, urls: list[str], get_client: Callable[[], httpx.AsyncClient]):
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.get_client = get_client
+        self.retries = 0
+        self._health_task: Optional[asyncio.Task] = None
+
+    def pick(self, exclude: set) -> Optional[OllamaEndpoint]:
+        """least-outstanding instance outside exclude, skipping open circuits; None when none is left"""
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and not e.circuit_open(now)]
+        # unhealthy instances are only used when no probed-healthy one is left
+        healthy = [e for e in candidates if e.healthy]
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        # total requests breaks ties so idle instances share the load
+        return min(candidates, key=lambda e: (e.outstanding, e.requests))
+
+    def _next_endpoint(self, tried: set, last_error: Optional[Exception]) -> OllamaEndpoint:
+        endpoint = self.pick(tried) if len(tried) < OLLAMA_MAX_ATTEMPTS else None
+        if endpoint is None:
+            if last_error is not None:
+                raise last_error
+            raise HTTPException(status_code=503, detail="no available Ollama instance")
+        if tried:
+            self.retries += 1
+        tried.add(endpoint)
+        endpoint.requests += 1
+        return endpoint
+
+    async def post_json(self, path: str, payload: dict, timeout: Optional[httpx.Timeout] = None) -> dict:
+        """POST to one instance, retrying retriable failures on another; generation calls are idempotent"""
+        client = self.get_client()
+        tried: set = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            endpoint.outstanding += 1
+            try:
+                response = await client.post(f"{endpoint.url}{path}", json=payload, timeout=timeout or client.timeout)
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                if not is_retriable(e):
+                    raise
+                endpoint.record_failure()
+                last_error = e
+                continue
+            finally:
+                endpoint.outstanding -= 1
+            endpoint.record_success()
+            return data
+
+    async def stream_lines(self, path: str, payload: dict, timeout: Optional[httpx.Timeout] = None) -> AsyncIterator[str]:
+        """streaming POST; retried on another instance only if nothing has been yielded yet"""
+        client = self.get_client()
+        tried: set = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            endpoint.outstanding += 1
+            started = False
+            try:
+                async with client.stream("POST", f"{endpoint.url}{path}", json=payload, timeout=timeout or client.timeout) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        started = True
+                        yield line
+            except Exception as e:
+                if started or not is_retriable(e):
+                    if is_retriable(e):
+                        endpoint.record_failure()
+                    raise
+                endpoint.record_failure()
+                last_error = e
+                continue
+            finally:
+                endpoint.outstanding -= 1
+            endpoint.record_success()
+            return
+
+    async def probe(self, endpoint: OllamaEndpoint):
+        try:
+            response = await self.get_client().get(f"{endpoint.url}/api/tags", timeout=OLLAMA_HEALTH_TIMEOUT)
+            response.raise_for_status()
+        except Exception:
+            endpoint.healthy = False
+            return
+        endpoint.healthy = True
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*[self.probe(endpoint) for endpoint in self.endpoints])
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    def start_health_checks(self):
+        if OLLAMA_HEALTH_INTERVAL > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def stats(self) -> dict:
+        return {"retries": self.retries, "instances": [endpoint.stats() for endpoint in self.endpoints]}
@@ -0,0 +1,47 @@
+from fake_backend import split_tokens
+from main import advice_limit_reached, format_advice_points
+
+
+def bounded(reply: str, max_words: int = 100) -> str:
+    """what bounded mode returns when reply streams in token by token"""
+    text = ""
+    for token in split_tokens(reply):
+        text += token
+        if advice_limit_reached(text, max_words):
+            break
+    return format_advice_points(text, max_words)
+
+
+def test_numbered_reply_keeps_three_tips():
+    reply = ("1. Eat more vegetables at dinner.\n2. Cut sugary drinks.\n"
+             "3. Choose whole grains over white rice.\n4. Walk after meals.")
+    assert bounded(reply) == ("• Eat more vegetables at dinner.\n• Cut sugary drinks.\n"
+                              "• Choose whole grains over white rice.")
+
+
+def test_dash_and_star_replies():
+    dash = "Here are some tips:\n- Drink water first.\n- Add beans.\n- Skip fried snacks.\n- Sleep more."
+    assert bounded(dash) == "• Drink water first.\n• Add beans.\n• Skip fried snacks."
+    star = "* Drink water first. * Add beans. * Skip fried snacks. * Sleep more."
+    assert bounded(star) == "• Drink water first.\n• Add beans.\n• Skip fried snacks."
+
+
+def test_decimals_and_abbreviations_are_not_points():
+    reply = "- Eat more fruit, e.g. 2.5 cups a day.\n- Limit salt to 1.5 g.\n- Keep protein at 1.2 g per kg."
+    assert bounded(reply) == "• Eat more fruit, e.g. 2.5 cups a day.\n• Limit salt to 1.5 g.\n• Keep protein at 1.2 g per kg."
+
+
+def test_prose_reply_is_bounded_by_words():
+    reply = "Try to eat more vegetables. " * 10
+    advice = bounded(reply, max_words=12)
+    assert advice.startswith("• Try to eat more vegetables.")
+    assert len(advice.split()) == 13  # 12 words plus the marker
+
+
+def test_dashes_inside_a_point_are_not_markers():
+    dash = ("- Breakfast - add two eggs for protein.\n- Lunch - swap fries for a salad.\n"
+            "- Dinner - keep rice to one cup.\n- Snack - fruit.")
+    assert bounded(dash) == ("• Breakfast - add two eggs for protein.\n• Lunch - swap fries for a salad.\n"
+                             "• Dinner - keep rice to one cup.")
+    numbered = "1. Aim for 2 - 3 servings of fruit daily.\n2. Drink water.\n3. Add beans.\n4. Sleep more."
+    assert bounded(numbered) == "• Aim for 2 - 3 servings of fruit daily.\n• Drink water.\n• Add beans."
@@ -0,0 +1,17 @@
+import asyncio
+
+import main
+from main import analyze_batch_packed
+
+
+def test_packed_items_are_validated(monkeypatch):
+    """malformed items in a packed reply fail one by one instead of being saved as zeros"""
+    async def reply(prompt, model=None):
+        return ('[{}, {"calories": "lots", "protein": -5}, '
+                '{"calories": 100, "protein": 1, "fat": 1, "carbohydrates": 1, "fiber": 0, "sugar": 0, "sodium": 0}]')
+
+    monkeypatch.setattr(main, "get_ai_response", reply)
+    empty, invalid, valid = asyncio.run(analyze_batch_packed(["mystery stew", "odd pie", "weird cake"]))
+    assert isinstance(empty, ValueError) and "calories" in str(empty)
+    assert isinstance(invalid, ValueError) and "protein" in str(invalid)
+    assert valid["calories"] == 100 and valid["minerals"]["iron"] == 0
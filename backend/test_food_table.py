@@ -0,0 +1,17 @@
+from food_table import food_index, parse_quantity
+
+
+def test_swapped_words_are_not_a_confident_match():
+    """"chocolate milk" must not be served from the "milk chocolate" entry"""
+    assert food_index.analyze("chocolate milk") is None
+    assert food_index.analyze("rice fried") is None
+    assert food_index.analyze("milk chocolate") is not None
+    assert food_index.analyze("fried rice") is not None
+
+
+def test_percent_is_not_a_serving_count():
+    for text in ["2% milk", "2 % milk", "2.5% milk"]:
+        _, grams, count = parse_quantity(text)
+        assert grams is None and count is None
+    assert parse_quantity("3 apples")[2] == 3
+    assert parse_quantity("1.5 bowls of rice")[2] == 1.5
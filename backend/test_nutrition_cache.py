@@ -0,0 +1,46 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db.db import Base
+from nutrition_cache import NutritionResultCache
+
+
+def run_with_cache(tmp_path, scenario):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            return await scenario(NutritionResultCache(), async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+
+def test_rolled_back_entries_never_reach_memory(tmp_path):
+    async def scenario(cache, sessions):
+        async with sessions() as db:
+            await cache.put(db, "odd pie", {"calories": "lots"})
+            await db.rollback()
+        async with sessions() as db:
+            assert await cache.get(db, "odd pie") is None
+            await cache.put(db, "apple pie", {"calories": 237})
+            assert cache.stats()["size"] == 0
+            await db.commit()
+        assert cache.stats()["size"] == 1
+    run_with_cache(tmp_path, scenario)
+
+
+def test_long_descriptions_get_their_own_entries(tmp_path):
+    a, b = "rice " * 60 + "with chicken", "rice " * 60 + "with tofu"
+
+    async def scenario(cache, sessions):
+        async with sessions() as db:
+            await cache.put(db, a, {"calories": 600})
+            await cache.put(db, b, {"calories": 450})
+            await db.commit()
+        cache.clear()
+        async with sessions() as db:
+            return await cache.get(db, a), await cache.get(db, b)
+    assert run_with_cache(tmp_path, scenario) == ({"calories": 600}, {"calories": 450})
@@ -0,0 +1,20 @@
+import asyncio
+
+import main
+from main import analyze_nutrition_structured
+
+
+def test_structured_retry_reports_the_invalid_reply(monkeypatch):
+    prompts = []
+
+    async def reply(prompt, model=None, json_schema=None):
+        prompts.append(prompt)
+        if len(prompts) == 1:
+            return '{"calories": -1}', 0
+        return '{"calories": 52, "protein": 0.3, "fat": 0.2, "carbohydrates": 14, "fiber": 2.4, "sugar": 10, "sodium": 1}', 0
+
+    monkeypatch.setattr(main, "get_ai_json_response", reply)
+    nutrition, _, _ = asyncio.run(analyze_nutrition_structured("an apple"))
+    assert nutrition["calories"] == 52
+    assert "Previous reply was invalid" not in prompts[0]
+    assert "Previous reply was invalid: calories" in prompts[1] and prompts[1].endswith("JSON:")
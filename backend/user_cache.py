@@ -0,0 +1,76 @@
+#已认证用户上下文缓存：User + UserProfile，按user_id缓存，短TTL
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.db import User, UserProfile
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() == "true"
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # seconds
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+
+class UserContext:
+    """the authenticated user and their profile (profile may be None)"""
+
+    def __init__(self, user: User, profile: Optional[UserProfile]):
+        self.user = user
+        self.profile = profile
+
+
+class UserContextCache:
+    """per-process cache of detached User/UserProfile objects, invalidated on writes"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple[float, UserContext]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db: AsyncSession, user_id: int) -> Optional[UserContext]:
+        """cached context for user_id, loading user and profile in one query on a miss"""
+        entry = self._entries.get(user_id) if USER_CACHE_ENABLED else None
+        if entry is not None and entry[0] >= time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = await db.execute(
+            select(User, UserProfile)
+            .outerjoin(UserProfile, UserProfile.user_id == User.id)
+            .where(User.id == user_id)
+        )
+        row = result.first()
+        if row is None:
+            self._entries.pop(user_id, None)
+            return None
+        user, profile = row
+        # detach so the cached objects never get flushed by another request's session
+        db.expunge(user)
+        if profile is not None:
+            db.expunge(profile)
+        context = UserContext(user, profile)
+        if USER_CACHE_ENABLED:
+            self._entries[user_id] = (time.monotonic() + self.ttl, context)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return context
+
+    def invalidate(self, user_id: int):
+        """drop a user's entry after their user or profile row changes"""
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_context_cache = UserContextCache()